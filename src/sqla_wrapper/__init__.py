@@ -1,4 +1,13 @@
 from .alembic_wrapper import *  # noqa
+from .backfill import *  # noqa
 from .base_model import *  # noqa
+from .batch_loader import *  # noqa
+from .middleware import *  # noqa
+from .migration_lock import *  # noqa
+from .migration_report import *  # noqa
+from .pool_stats import *  # noqa
+from .reflection_cache import *  # noqa
+from .revision_cache import *  # noqa
 from .session import *  # noqa
 from .sqlalchemy_wrapper import *  # noqa
+from .transaction import *  # noqa
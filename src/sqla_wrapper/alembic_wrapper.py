@@ -1,13 +1,39 @@
+import copy
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import pickle
 import shutil
+import tempfile
 import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from time import perf_counter
+
+import sqlalchemy as sa
 
 from alembic import autogenerate, util
 from alembic.config import Config
+from alembic.operations import ops
 from alembic.runtime.environment import EnvironmentContext
+from alembic.runtime.migration import MigrationContext
 from alembic.script import Script, ScriptDirectory
 
+from .backfill import PROGRESS_TABLE as BACKFILLS_TABLE
 from .cli import click_cli, proper_cli_cli
+from .json_file import write_json
+from .migration_lock import migration_lock
+from .migration_report import (
+    DatabaseResult,
+    MigrationReport,
+    MigrationStep,
+    SchemaChange,
+    _StepRecorder,
+)
+from .reflection_cache import ReflectionCache
+from .revision_cache import RevisionCache
 from .sqlalchemy_wrapper import SQLAlchemy
 
 
@@ -15,6 +41,15 @@ __all__ = ("Alembic",)
 
 StrPath = t.Union[str, Path]
 DEFAULT_FILE_TEMPLATE = "%%(year)d_%%(month).2d_%%(day).2d_%%(rev)s_%%(slug)s"
+DEFAULT_REVISION_CACHE = "__pycache__/sqla_wrapper_revisions.json"
+DEFAULT_REFLECTION_CACHE = "__pycache__/sqla_wrapper_reflection.json"
+LOCK_NAME = "sqla_wrapper_migrations"
+SQUASHED_DIR = "squashed"
+DEFAULT_SNAPSHOTS_DIR = "__pycache__/sqla_wrapper_snapshots"
+# Stands for the schema of the tenant in the recorded snapshots
+TENANT_PLACEHOLDER = "__sqla_wrapper_tenant__"
+# The commands that need the models, so `run_many()` can't run them
+MODEL_COMMANDS = ("revision", "check", "squash", "create_all")
 TEMPLATE_FILE = "script.py.mako"
 
 
@@ -25,36 +60,112 @@ class Alembic:
     can read the
     [documentation for the Alembic config](https://alembic.sqlalchemy.org/en/latest/tutorial.html#editing-the-ini-file).
 
+    For schema-per-tenant databases, use `for_tenant(schema)` to get a
+    copy that works with the tables of that schema (with its own version table),
+    or `upgrade_tenants(schemas)` to upgrade all of them.
+
+    With many revisions, reading all of them to find the current head can
+    take seconds. With `revision_cache=True`, the revision graph is stored
+    in a file and the read-only methods (`get_head()`, `get_history()`,
+    `get_current()`, etc.) use it instead of importing every revision file.
+    Only the files that changed since the last time are read again.
+
+    On big databases, `revision()` spends most of its time reading the
+    definition of every table. With `reflection_cache=True`, the tables
+    that had no changes the last time, and whose definition didn't change
+    since then, in the models nor in the database, are not read again
+    (see `ReflectionCache`).
+
+    The migrations are run while holding a lock in the database (see
+    `lock()`), so when many instances of an application start at the same
+    time and all call `upgrade()`, only one runs them and the others wait
+    and then find the database up to date.
+
     Args:
         db: A `sqla_wrapper.SQLAlchemy` instance.
         path: Path to the migrations folder.
+        revision_cache: Cache the revision graph. Either `True`, to use
+            a file in the `__pycache__` folder of the migrations, or the
+            path of the cache file.
+        reflection_cache: Cache which tables were unchanged in the last
+            `revision()`. Either `True`, to use a file in the `__pycache__`
+            folder of the migrations, or the path of the cache file.
+        lock_timeout: Maximum seconds to wait for the migrations lock, or
+            `None` to wait forever.
         **options: Other alembic options
 
     """
 
+    #: Schema of the tenant, see `for_tenant()`.
+    tenant: "str | None" = None
+
     def __init__(
         self,
         db: SQLAlchemy,
         path: StrPath = "db/migrations",
+        *,
+        revision_cache: "bool | StrPath" = False,
+        reflection_cache: "bool | StrPath" = False,
+        lock_timeout: "float | None" = 300.0,
         **options,
     ) -> None:
         self.db = db
+        self.lock_timeout = lock_timeout
         self.path = path = Path(path).absolute()
+        # To make a copy in another process, see `run_many()`
+        self._options = dict(options)
         options["script_location"] = str(path)
         self.config = self._get_config(options)
         self.init(path)
         self.script_directory = ScriptDirectory.from_config(self.config)
+        self.revision_cache: "RevisionCache | None" = None
+        if revision_cache:
+            cache_path = (
+                path / DEFAULT_REVISION_CACHE
+                if revision_cache is True
+                else Path(revision_cache)
+            )
+            self.revision_cache = RevisionCache(self.script_directory, cache_path)
+        self.reflection_cache: "ReflectionCache | None" = None
+        if reflection_cache:
+            self.reflection_cache = ReflectionCache(
+                path / DEFAULT_REFLECTION_CACHE
+                if reflection_cache is True
+                else Path(reflection_cache)
+            )
 
     def revision(
-        self, message: str, *, empty: bool = False, parent: str = "head"
+        self,
+        message: str,
+        *,
+        empty: bool = False,
+        parent: str = "head",
+        include_tables: "t.Iterable[str] | None" = None,
+        include_schemas: "t.Iterable[str | None] | None" = None,
+        include_object: "t.Callable[..., bool] | None" = None,
     ) -> "Script | None":
         """Create a new revision.
         Auto-generate operations by comparing models and database.
 
+        By default, every table of the models and of the database is
+        compared. On a big database, limit it to the tables you are working
+        on, so the rest are not read:
+
+        ```python
+        alembic.revision("add user emails", include_tables=["users", "user_*"])
+        ```
+
         Args:
             message: Revision message.
             empty: Generate just an empty migration file, not the operations.
             parent: Parent revision of this new revision.
+            include_tables: Optional names of the tables to compare.
+                Can include `*` and `?` wildcards.
+            include_schemas: Optional names of the schemas to compare,
+                `None` being the default one. Without it, only the
+                default schema is read from the database.
+            include_object: Optional alembic `include_object` function,
+                to also filter the columns, indexes, etc. to compare.
 
         """
         revision_context = autogenerate.RevisionContext(
@@ -72,25 +183,51 @@ class Alembic:
             },
         )
 
+        cache = self.reflection_cache if include_object is None else None
+
         def do_revision(revision, context):
             if empty:
                 revision_context.run_no_autogenerate(revision, context)
-            else:
-                revision_context.run_autogenerate(revision, context)
+                return []
+            if cache is not None:
+                cache.start(context.connection, self.db.registry.metadata)
+            revision_context.run_autogenerate(revision, context)
+            if cache is not None:
+                cache.save(revision_context.generated_revisions[-1].upgrade_ops)
             return []
 
-        self._run_online(do_revision)
+        # It only writes a file, so it doesn't need the migrations lock
+        self._run_online(
+            do_revision,
+            lock=False,
+            **self._get_autogenerate_filters(
+                include_tables, include_schemas, include_object, cache
+            ),
+        )
 
         result = list(revision_context.generate_scripts())
         return result[0]
 
-    def upgrade(self, target: str = "head", *, sql: bool = False, **kwargs) -> None:
+    def upgrade(
+        self,
+        target: str = "head",
+        *,
+        sql: bool = False,
+        progress: "t.Callable[[MigrationStep], t.Any] | None" = None,
+        **kwargs,
+    ) -> "MigrationReport | None":
         """Run migrations to upgrade database.
 
+        Returns a `MigrationReport` with the time each revision took,
+        and the number of statements and rows affected, or `None` if
+        `sql=True`.
+
         Args:
             target: Revision target or "from:to" range if `sql=True`.
                 "head" by default.
             sql: Don't emit SQL to database, dump to standard output instead.
+            progress: Optional function called with a `MigrationStep` after
+                each revision is applied.
             kwargs: Optional arguments.
 
                 If these are passed, they are sent directly
@@ -98,7 +235,14 @@ class Alembic:
                 To use, modify the `script.py.mako`template file
                 so that the `upgrade()` functions can accept arguments.
 
+        When upgrading to "head", if the database is already there this
+        returns right away, without running the migration environment.
+        This is checked again after getting the migrations lock.
+
         """
+        if not sql and target in ("head", "heads") and self.is_up_to_date():
+            return MigrationReport()
+
         starting_rev = None
         if ":" in target:
             if not sql:
@@ -110,22 +254,36 @@ class Alembic:
         def do_upgrade(revision, context):
             return self.script_directory._upgrade_revs(target, revision)
 
-        run = self._run_offline if sql else self._run_online
-        run(
-            do_upgrade,
-            kwargs=kwargs,
-            starting_rev=starting_rev,
-            destination_rev=target,
-        )
+        if sql:
+            self._run_offline(
+                do_upgrade,
+                kwargs=kwargs,
+                starting_rev=starting_rev,
+                destination_rev=target,
+            )
+            return None
+        with self.lock():
+            return self._upgrade(target, kwargs=kwargs, progress=progress)
 
-    def downgrade(self, target: str = "-1", *, sql: bool = False, **kwargs) -> None:
+    def downgrade(
+        self,
+        target: str = "-1",
+        *,
+        sql: bool = False,
+        progress: "t.Callable[[MigrationStep], t.Any] | None" = None,
+        **kwargs,
+    ) -> "MigrationReport | None":
         """Run migrations to downgrade database.
 
+        Returns a `MigrationReport`, like `upgrade()`.
+
         Args:
             target: Revision target as an integer relative to the current
                 state (e.g.: "-1"), or as a "from:to" range if `sql=True`.
                 "-1" by default.
             sql: Don't emit SQL to database, dump to standard output instead.
+            progress: Optional function called with a `MigrationStep` after
+                each revision is reverted.
             kwargs: Optional arguments.
                 If these are passed, they are sent directly
                 to the `downgrade()` functions within each revision file.
@@ -148,11 +306,18 @@ class Alembic:
         def do_downgrade(revision, context):
             return self.script_directory._downgrade_revs(target, revision)
 
-        run = self._run_offline if sql else self._run_online
-        run(
+        if sql:
+            self._run_offline(
+                do_downgrade,
+                kwargs=kwargs,
+                starting_rev=starting_rev,
+                destination_rev=target,
+            )
+            return None
+        return self._run_online(
             do_downgrade,
             kwargs=kwargs,
-            starting_rev=starting_rev,
+            progress=progress,
             destination_rev=target,
         )
 
@@ -175,7 +340,7 @@ class Alembic:
             end = current.revision if current else "heads"
 
         return list(
-            self.script_directory.walk_revisions(start or "base", end or "heads")
+            self._get_scripts().walk_revisions(start or "base", end or "heads")
         )[::-1]
 
     def history(
@@ -228,15 +393,296 @@ class Alembic:
             purge=purge,
         )
 
+    def squash(
+        self, up_to: str, *, scratch_url: "str | None" = None
+    ) -> "Script | None":
+        """Replace all the revisions up to `up_to` (including it) with
+        a single "baseline" revision that creates the schema as it is
+        after them, so new databases don't have to run each one.
+
+        The baseline takes the id of the `up_to` revision, so the later
+        revisions and the databases already at `up_to` or after it don't
+        notice the difference. The replaced revision files are moved to
+        a `squashed/<up_to>` folder inside the migrations folder, and
+        `upgrade()` uses them to bring the databases still at one of those
+        revisions up to the baseline first.
+
+        To get the schema, the revisions are run on a scratch database
+        and then it's reflected. By default, that's a temporary SQLite
+        database, so if the migrations use features of another database,
+        give the URL of an empty one of the same kind as `scratch_url`.
+        Note that the rows inserted by the replaced migrations, if any,
+        are not part of the baseline.
+
+        Args:
+            up_to: Last revision to squash.
+            scratch_url: URL of an empty database to run the revisions on.
+
+        """
+        scripts = self.script_directory
+        target = scripts.get_revision(up_to)
+        assert target is not None
+        squashed = list(scripts.walk_revisions("base", target.revision))
+        ids = {script.revision for script in squashed}
+        for script in scripts.walk_revisions():
+            inside = (set(script._all_down_revisions) & ids) - {target.revision}
+            if script.revision not in ids and inside:
+                raise ValueError(
+                    f"Can't squash: revision {script.revision} depends on "
+                    f"{', '.join(sorted(inside))}, which would be squashed"
+                )
+
+        metadata = self._reflect_revision(target.revision, scratch_url)
+        tmp_path = Path(tempfile.mkdtemp())
+        try:
+            baseline = self._write_baseline(target, metadata, tmp_path)
+            archive = self.path / SQUASHED_DIR / target.revision
+            archive.mkdir(parents=True, exist_ok=True)
+            for script in squashed:
+                shutil.move(script.path, archive / Path(script.path).name)
+            baseline_path = Path(target.path).parent / Path(baseline.path).name
+            shutil.move(baseline.path, baseline_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.script_directory = ScriptDirectory.from_config(self.config)
+        if self.revision_cache is not None:
+            self.revision_cache = RevisionCache(
+                self.script_directory, self.revision_cache.path
+            )
+        return self.script_directory.get_revision(target.revision)
+
+    def lock(self) -> t.ContextManager[None]:
+        """Return a context manager that holds the migrations lock of the
+        database (or of the schema of the tenant), waiting up to
+        `lock_timeout` seconds for it. All the commands that change the
+        database use it.
+
+        It's an advisory lock on PostgreSQL, `GET_LOCK()` on MySQL/MariaDB,
+        and a lock file next to the database file on SQLite.
+        """
+        name = LOCK_NAME if self.tenant is None else f"{LOCK_NAME}_{self.tenant}"
+        return migration_lock(self.db.engine, name, self.lock_timeout)
+
+    def for_tenant(self, schema: str) -> "Alembic":
+        """Return a copy of this object that runs the migrations on the
+        `schema` of a tenant.
+
+        The tables without an explicit schema are created in that schema,
+        and the version table is stored there as well.
+
+        Args:
+            schema: Name of the schema of the tenant.
+
+        """
+        alembic = copy.copy(self)
+        alembic.tenant = schema
+        return alembic
+
+    def run_many(
+        self,
+        databases: "t.Iterable[str | SQLAlchemy]",
+        command: str = "upgrade",
+        *args: t.Any,
+        workers: int = 4,
+        **kwargs: t.Any,
+    ) -> t.List[DatabaseResult]:
+        """Run a command (the name of a method of this class, e.g.:
+        "upgrade", "stamp", "get_current" or "is_up_to_date") with the same
+        migrations on many databases, up to `workers` of them at a time.
+
+        Alembic keeps the migration context in global variables, so each
+        database is migrated in a separate process. The processes are
+        started fresh (not forked), so it's safe to call this when other
+        threads are running, but as with any `multiprocessing` code, the
+        main module of the program must be importable without side effects
+        (guard the entry point with `if __name__ == "__main__":`).
+
+        Each process makes its own `Alembic`, with the same options, for
+        a `SQLAlchemy` connected to the URL of each database. The models are
+        not loaded there, so the commands that use them (`revision`, `check`,
+        `squash` and `create_all`) can't be used, and the `args` and `kwargs`
+        must be picklable. With `workers=1`, the databases are migrated one at
+        a time, in this process.
+
+        An error in one database doesn't stop the others. Returns a list of
+        `DatabaseResult`, in the same order as the databases, with the
+        value returned by the command (revisions are returned as their ids)
+        or the error raised by it.
+
+        **Example**:
+
+        ```python
+        results = alembic.run_many(urls, "upgrade", workers=8)
+        failed = [res for res in results if not res.ok]
+        ```
+
+        Args:
+            databases: Database URLs, or `SQLAlchemy` instances.
+            command: Name of the method to run on each database.
+            args: Positional arguments for the command.
+            workers: Maximum number of databases migrated at the same time.
+            kwargs: Keyword arguments for the command.
+
+        """
+        if isinstance(databases, (str, SQLAlchemy)):
+            raise TypeError("`databases` must be a list of URLs, not a single one")
+        if (
+            command.startswith("_")
+            or command in MODEL_COMMANDS
+            or not callable(getattr(self, command, None))
+        ):
+            raise ValueError(f"Unknown command {command!r}")
+        databases = list(databases)
+        if workers < 2:
+            return [
+                _run_one(self, command, args, kwargs, database)
+                for database in databases
+            ]
+
+        urls = [
+            database
+            if isinstance(database, str)
+            else database.engine.url.render_as_string(hide_password=False)
+            for database in databases
+        ]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(urls)) or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._get_spec(), command, args, kwargs),
+        ) as executor:
+            return list(executor.map(_run_in_worker, urls))
+
+    def upgrade_many(
+        self,
+        databases: "t.Iterable[str | SQLAlchemy]",
+        target: str = "head",
+        *,
+        workers: int = 4,
+        **kwargs: t.Any,
+    ) -> t.List[DatabaseResult]:
+        """Run the migrations to upgrade many databases, up to `workers` of
+        them at a time. See `run_many()`.
+
+        Args:
+            databases: Database URLs, or `SQLAlchemy` instances.
+            target: Revision target. "head" by default.
+            workers: Maximum number of databases migrated at the same time.
+            kwargs: Optional arguments passed to the `upgrade()` functions
+                within each revision file.
+
+        """
+        return self.run_many(databases, "upgrade", target, workers=workers, **kwargs)
+
+    def upgrade_tenants(
+        self,
+        schemas: t.Iterable[str],
+        target: str = "head",
+        *,
+        create_schema: bool = True,
+        **kwargs,
+    ) -> None:
+        """Run the migrations to upgrade the schema of each tenant.
+
+        Args:
+            schemas: Names of the schemas of the tenants.
+            target: Revision target. "head" by default.
+            create_schema: Create the schemas if they don't exist.
+            kwargs: Optional arguments passed to the `upgrade()` functions
+                within each revision file.
+
+        """
+        for schema in schemas:
+            if create_schema:
+                with self.db.engine.begin() as connection:
+                    connection.execute(
+                        sa.schema.CreateSchema(schema, if_not_exists=True)
+                    )
+            self.for_tenant(schema).upgrade(target, **kwargs)
+
+    def is_up_to_date(self) -> bool:
+        """Return `True` if the latest revisions have been applied to
+        the database.
+
+        This only does one query to read the version table, and it's even
+        faster with `revision_cache=True`, so it can be used when an
+        application starts.
+        """
+        heads = self._get_scripts().get_heads()
+        return set(self._get_current_heads()) == set(heads)
+
+    def check(
+        self,
+        *,
+        include_tables: "t.Iterable[str] | None" = None,
+        include_schemas: "t.Iterable[str | None] | None" = None,
+        include_object: "t.Callable[..., bool] | None" = None,
+    ) -> t.List[SchemaChange]:
+        """Compare the models with the database and return the differences,
+        as a list of `SchemaChange`. An empty list means that they match.
+
+        This runs the same comparison as `revision()`, but in memory: no
+        revision file is written and the migrations lock is not taken, so
+        it can be used in tests, in CI, or when an application starts.
+        Use the same filters to compare fewer tables and make it faster.
+
+        **Example**:
+
+        ```python
+        changes = alembic.check()
+        if changes:
+            raise RuntimeError(f"The database doesn't match the models: {changes}")
+        ```
+
+        Args:
+            include_tables: Optional names of the tables to compare.
+                Can include `*` and `?` wildcards.
+            include_schemas: Optional names of the schemas to compare,
+                `None` being the default one.
+            include_object: Optional alembic `include_object` function,
+                to also filter the columns, indexes, etc. to compare.
+
+        """
+        cache = self.reflection_cache if include_object is None else None
+        metadata = self.db.registry.metadata
+        with self._connect() as connection:
+            migration_context = MigrationContext.configure(
+                connection,
+                opts={
+                    "target_metadata": metadata,
+                    **self._get_tenant_envargs(),
+                    **self._get_autogenerate_filters(
+                        include_tables, include_schemas, include_object, cache
+                    ),
+                },
+            )
+            if cache is not None:
+                cache.start(connection, metadata)
+            upgrade_ops = autogenerate.produce_migrations(
+                migration_context, metadata
+            ).upgrade_ops
+        if cache is not None:
+            cache.save(upgrade_ops)
+
+        changes = []
+        for diff in upgrade_ops.as_diffs():
+            # The changes to the same column are grouped in a list
+            for item in diff if isinstance(diff, list) else [diff]:
+                changes.append(SchemaChange.from_diff(item))
+        return changes
+
+    def _get_current_heads(self) -> t.Tuple[str, ...]:
+        """Get the ids of the last revisions applied."""
+        with self._connect() as connection:
+            migration_context = MigrationContext.configure(
+                connection, opts=self._get_tenant_envargs()
+            )
+            return migration_context.get_current_heads()
+
     def _get_currents(self) -> "t.Tuple[Script | None, ...]":
         """Get the last revisions applied."""
-        env = EnvironmentContext(self.config, self.script_directory)
-        with self.db.engine.connect() as connection:
-            env.configure(connection=connection)
-            migration_context = env.get_context()
-            current_heads = migration_context.get_current_heads()
-
-        return self.script_directory.get_revisions(current_heads)
+        return self._get_scripts().get_revisions(self._get_current_heads())
 
     def get_current(self) -> "Script | None":
         """Get the last revision applied."""
@@ -263,7 +709,7 @@ class Alembic:
 
     def _get_heads(self) -> "t.Tuple[Script | None, ...]":
         """Get the list of the latest revisions."""
-        return self.script_directory.get_revisions("heads")
+        return self._get_scripts().get_revisions("heads")
 
     def get_head(self) -> "Script | None":
         """Get the latest revision."""
@@ -306,12 +752,46 @@ class Alembic:
         if not dest_path.exists():
             shutil.copy(src_path, path)
 
-    def create_all(self) -> None:
+    def create_all(self, *, snapshot: "bool | StrPath" = False) -> None:
         """Create all the tables from the current models
         and stamp the latest revision without running any migration.
+
+        With `snapshot`, the database is instead upgraded to the latest
+        revision and every statement that changes it (including those of
+        the data migrations) is saved to a snapshot file. The next time,
+        if neither the revisions heads nor the models have changed, the
+        statements are replayed from the file in a single transaction,
+        which is much faster than running the migrations. Useful for
+        creating test or tenant databases.
+
+        The snapshot is only used or recorded for a database without any
+        revision applied; otherwise this works as if it was `False`.
+        With `for_tenant()`, the schema of the tenant is replaced in the
+        snapshot, so it can be used for any other tenant.
+
+        Args:
+            snapshot: `True` to store the snapshots in the `__pycache__`
+                folder of the migrations, or the path of a folder.
+
         """
-        self.db.create_all()
-        self.stamp()
+        if not snapshot or self._get_current_heads():
+            self.db.create_all()
+            self.stamp()
+            return
+
+        folder = (
+            self.path / DEFAULT_SNAPSHOTS_DIR if snapshot is True else Path(snapshot)
+        )
+        snapshot_path = folder / f"{self._get_snapshot_key()}.json"
+        with self.lock():
+            # Another process could have created the database while this
+            # one was waiting for the lock.
+            if self._get_current_heads():
+                return
+            if snapshot_path.exists():
+                self._replay_snapshot(snapshot_path)
+            else:
+                self._record_snapshot(snapshot_path)
 
     def rev_id(self) -> str:
         """Generate a unique id for a revision.
@@ -332,6 +812,241 @@ class Alembic:
 
     # Private
 
+    def _get_scripts(self) -> ScriptDirectory:
+        """The script directory to read the revisions from; the cached one
+        if there is a revision cache.
+        """
+        if self.revision_cache is None:
+            return self.script_directory
+        return self.revision_cache.get_script_directory()
+
+    def _reflect_revision(
+        self, revision: str, scratch_url: "str | None"
+    ) -> sa.MetaData:
+        """Return the schema of a database upgraded to the revision."""
+        tmp_path = Path(tempfile.mkdtemp())
+        scratch = copy.copy(self)
+        scratch.db = SQLAlchemy(scratch_url or f"sqlite:///{tmp_path / 'scratch.db'}")
+        scratch.tenant = None
+        try:
+            scratch.upgrade(revision)
+            metadata = sa.MetaData()
+            metadata.reflect(scratch.db.engine)
+        finally:
+            scratch.db.engine.dispose()
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        version_table = metadata.tables.get("alembic_version")
+        if version_table is not None:
+            metadata.remove(version_table)
+        return metadata
+
+    def _write_baseline(
+        self, target: Script, metadata: sa.MetaData, version_path: Path
+    ) -> Script:
+        tables = metadata.sorted_tables
+        upgrade_ops = ops.UpgradeOps(
+            [ops.CreateTableOp.from_table(table) for table in tables]
+            + [
+                ops.CreateIndexOp.from_index(index)
+                for table in tables
+                for index in sorted(table.indexes, key=lambda index: index.name)
+            ]
+        )
+        downgrade_ops = ops.DowngradeOps(
+            [ops.DropTableOp.from_table(table) for table in reversed(tables)]
+        )
+        config = self._copy_config(version_locations=str(version_path))
+        script = ScriptDirectory.from_config(config).generate_revision(
+            target.revision,
+            f"Squashed revisions up to {target.revision}",
+            version_path=str(version_path),
+            upgrades=autogenerate.render_python_code(upgrade_ops),
+            downgrades=autogenerate.render_python_code(downgrade_ops),
+            imports="",
+        )
+        assert script is not None
+        return script
+
+    def _get_snapshot_key(self) -> str:
+        """A hash of the heads and the schema of the models."""
+        engine = self.db.engine
+        key = hashlib.sha256()
+        tenant = TENANT_PLACEHOLDER if self.tenant else ""
+        for value in (engine.dialect.name, tenant, *sorted(
+            self._get_scripts().get_heads()
+        )):
+            key.update(f"{value}\n".encode())
+        for table in self.db.registry.metadata.sorted_tables:
+            key.update(str(sa.schema.CreateTable(table).compile(engine)).encode())
+            for index in sorted(table.indexes, key=lambda index: index.name or ""):
+                key.update(str(sa.schema.CreateIndex(index).compile(engine)).encode())
+        return key.hexdigest()[:32]
+
+    def _record_snapshot(self, snapshot_path: Path) -> None:
+        """Upgrade the database, saving every statement executed by the
+        migrations. The migrations lock must be held.
+        """
+        statements: t.List[t.Any] = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append([statement, parameters, executemany])
+
+        self._upgrade("head", listeners={"before_cursor_execute": record})
+
+        if self.tenant:
+            statements = self._replace_schema(
+                statements, self.tenant, TENANT_PLACEHOLDER
+            )
+        try:
+            write_json(snapshot_path, statements)
+        except TypeError:
+            # Parameters that can't be stored, so no snapshot this time
+            pass
+
+    def _replay_snapshot(self, snapshot_path: Path) -> None:
+        """Run the statements of a snapshot. The migrations lock must be held."""
+        statements = json.loads(snapshot_path.read_text())
+        if self.tenant:
+            statements = self._replace_schema(
+                statements, TENANT_PLACEHOLDER, self.tenant
+            )
+        with self._connect() as connection:
+            with connection.begin():
+                for statement, parameters, executemany in statements:
+                    if executemany:
+                        parameters = [_to_params(params) for params in parameters]
+                    else:
+                        parameters = _to_params(parameters)
+                    connection.exec_driver_sql(statement, parameters)
+
+    def _replace_schema(
+        self, statements: t.List[t.Any], old: str, new: str
+    ) -> t.List[t.Any]:
+        """Replace the name of a schema in the recorded statements, where it
+        qualifies a table (e.g.: `"old".table`) or it's a parameter.
+        """
+        preparer = self.db.engine.dialect.identifier_preparer
+        # Quoted only if needed, and always quoted
+        prefixes = [
+            (f"{format(old)}.", f"{format(new)}.")
+            for format in (preparer.format_schema, preparer.quote_identifier)
+        ]
+
+        def replace_statement(statement):
+            for old_prefix, new_prefix in prefixes:
+                statement = statement.replace(old_prefix, new_prefix)
+            return statement
+
+        def replace_param(value):
+            if isinstance(value, dict):
+                return {key: replace_param(val) for key, val in value.items()}
+            if isinstance(value, (list, tuple)):
+                return type(value)(replace_param(val) for val in value)
+            return new if value == old else value
+
+        return [
+            [replace_statement(statement), replace_param(params), many]
+            for statement, params, many in statements
+        ]
+
+    def _upgrade(
+        self,
+        target: str,
+        *,
+        kwargs: "dict | None" = None,
+        progress: "t.Callable[[MigrationStep], t.Any] | None" = None,
+        listeners: "t.Dict[str, t.Callable] | None" = None,
+    ) -> MigrationReport:
+        """Upgrade the database. The migrations lock must be held."""
+        # Another process could have run the migrations while this one
+        # was waiting for the lock.
+        if target in ("head", "heads") and self.is_up_to_date():
+            return MigrationReport()
+        self._upgrade_squashed()
+
+        def do_upgrade(revision, context):
+            return self.script_directory._upgrade_revs(target, revision)
+
+        return self._run_online(
+            do_upgrade,
+            kwargs=kwargs,
+            progress=progress,
+            lock=False,
+            listeners=listeners,
+            destination_rev=target,
+        )
+
+    def _upgrade_squashed(self) -> None:
+        """Upgrade a database at a revision that has been squashed to the
+        baseline that replaced it, using the archived revision files.
+        """
+        archive = self.path / SQUASHED_DIR
+        if not archive.is_dir():
+            return
+        while True:
+            unknown = [
+                rev for rev in self._get_current_heads() if not self._has_revision(rev)
+            ]
+            if not unknown:
+                return
+            for folder in sorted(archive.iterdir()):
+                archived = copy.copy(self)
+                archived.config = self._copy_config(version_locations=str(folder))
+                archived.script_directory = ScriptDirectory.from_config(
+                    archived.config
+                )
+                archived.revision_cache = None
+                if archived._has_revision(unknown[0]):
+                    archived._upgrade(folder.name)
+                    break
+            else:
+                # Let alembic complain about it
+                return
+
+    def _has_revision(self, revision: str) -> bool:
+        try:
+            return self.script_directory.get_revision(revision) is not None
+        except util.CommandError:
+            return False
+
+    def _copy_config(self, **options: str) -> Config:
+        """Return a new config with the same options as this one, except
+        the given ones.
+        """
+        section = self.config.config_ini_section
+        values = dict(self.config.file_config.items(section, raw=True))
+        values.update(options)
+        config = Config()
+        for key, value in values.items():
+            config.set_main_option(key, value)
+        return config
+
+    def _get_spec(self) -> t.Dict[str, t.Any]:
+        """The arguments to make a copy of this object in another process."""
+        return {
+            "path": str(self.path),
+            "tenant": self.tenant,
+            "lock_timeout": self.lock_timeout,
+            "revision_cache": (
+                False if self.revision_cache is None else self.revision_cache.path
+            ),
+            "options": self._options,
+        }
+
+    @classmethod
+    def _from_spec(cls, spec: t.Dict[str, t.Any], db: SQLAlchemy) -> "Alembic":
+        alembic = cls(
+            db,
+            spec["path"],
+            revision_cache=spec["revision_cache"],
+            lock_timeout=spec["lock_timeout"],
+            **spec["options"],
+        )
+        if spec["tenant"] is not None:
+            alembic = alembic.for_tenant(spec["tenant"])
+        return alembic
+
     def _get_config(self, options: dict[str, str]) -> Config:
         options.setdefault("file_template", DEFAULT_FILE_TEMPLATE)
         options.setdefault("version_locations", options["script_location"])
@@ -343,20 +1058,111 @@ class Alembic:
         return config
 
     def _run_online(
-        self, fn: t.Callable, *, kwargs: "dict | None" = None, **envargs
-    ) -> None:
-        """Emit the SQL to the database."""
-        env = EnvironmentContext(self.config, self.script_directory)
-        with self.db.engine.connect() as connection:
-            env.configure(
-                connection=connection,
-                fn=fn,
-                target_metadata=self.db.registry.metadata,
-                **envargs,
-            )
-            kwargs = kwargs or {}
-            with env.begin_transaction():
-                env.run_migrations(**kwargs)
+        self,
+        fn: t.Callable,
+        *,
+        kwargs: "dict | None" = None,
+        progress: "t.Callable[[MigrationStep], t.Any] | None" = None,
+        lock: bool = True,
+        listeners: "t.Dict[str, t.Callable] | None" = None,
+        **envargs,
+    ) -> MigrationReport:
+        """Emit the SQL to the database, holding the migrations lock unless
+        `lock` is `False`.
+
+        `listeners` are extra connection events, e.g.: to see the statements.
+        """
+        report = MigrationReport()
+        with self.lock() if lock else nullcontext():
+            recorder = _StepRecorder(report, progress)
+            env = EnvironmentContext(self.config, self.script_directory)
+            with self._connect() as connection:
+                sa.event.listen(
+                    connection, "before_cursor_execute", recorder.before_cursor_execute
+                )
+                sa.event.listen(
+                    connection, "after_cursor_execute", recorder.after_cursor_execute
+                )
+                for identifier, listener in (listeners or {}).items():
+                    sa.event.listen(connection, identifier, listener)
+                env.configure(
+                    connection=connection,
+                    fn=fn,
+                    target_metadata=self.db.registry.metadata,
+                    on_version_apply=recorder.on_version_apply,
+                    **self._get_tenant_envargs(),
+                    **envargs,
+                )
+                kwargs = kwargs or {}
+                with env.begin_transaction():
+                    env.run_migrations(**kwargs)
+            recorder.finish()
+        return report
+
+    def _get_autogenerate_filters(
+        self,
+        include_tables: "t.Iterable[str] | None",
+        include_schemas: "t.Iterable[str | None] | None",
+        include_object: "t.Callable[..., bool] | None",
+        cache: "ReflectionCache | None",
+    ) -> t.Dict[str, t.Any]:
+        """Return the alembic options to compare only some of the tables."""
+        tables = None if include_tables is None else list(include_tables)
+        schemas = None if include_schemas is None else set(include_schemas)
+        dialect = self._get_engine().dialect
+
+        def is_schema_included(schema):
+            if schemas is None or schema in schemas:
+                return True
+            # Known once connected
+            return schema is None and dialect.default_schema_name in schemas
+
+        def is_table_included(name, schema):
+            if not is_schema_included(schema):
+                return False
+            if tables is not None and not any(
+                fnmatch.fnmatchcase(name, pattern) for pattern in tables
+            ):
+                return False
+            if cache is None:
+                return True
+            cache.mark_compared(name, schema)
+            return cache.is_needed(name, schema)
+
+        def include_name_fn(name, type_, parent_names):
+            if type_ == "schema":
+                return is_schema_included(name)
+            if type_ == "table":
+                # Created by `backfill()`, not by the models
+                if name == BACKFILLS_TABLE:
+                    return False
+                return is_table_included(name, parent_names.get("schema_name"))
+            return True
+
+        def include_object_fn(obj, name, type_, reflected, compare_to):
+            if type_ == "table" and not is_table_included(name, obj.schema):
+                return False
+            if include_object is not None:
+                return include_object(obj, name, type_, reflected, compare_to)
+            return True
+
+        envargs = {"include_name": include_name_fn, "include_object": include_object_fn}
+        if schemas is not None:
+            envargs["include_schemas"] = True
+        return envargs
+
+    def _connect(self) -> sa.Connection:
+        return self._get_engine().connect()
+
+    def _get_engine(self) -> sa.Engine:
+        if self.tenant is None:
+            return self.db.engine
+        return self.db.tenant_engine(self.tenant)
+
+    def _get_tenant_envargs(self) -> t.Dict[str, t.Any]:
+        if self.tenant is None:
+            return {}
+        return {"version_table_schema": self.tenant}
 
     def _run_offline(
         self, fn: t.Callable, *, kwargs: "dict | None" = None, **envargs
@@ -373,3 +1179,74 @@ class Alembic:
         kwargs = kwargs or {}
         with env.begin_transaction():
             env.run_migrations(**kwargs)
+
+
+def _to_params(params: t.Any) -> t.Any:
+    # JSON turns the tuples of positional parameters into lists
+    return tuple(params) if isinstance(params, list) else params
+
+
+# What `Alembic.run_many()` is running, in each of its worker processes
+_worker_state: t.Any = None
+
+
+def _init_worker(
+    spec: t.Dict[str, t.Any], command: str, args: tuple, kwargs: dict
+) -> None:
+    global _worker_state
+    # The database is set by `_run_one()`
+    alembic = Alembic._from_spec(spec, db=None)  # type: ignore
+    _worker_state = (alembic, command, args, kwargs)
+
+
+def _run_in_worker(url: str) -> DatabaseResult:
+    alembic, command, args, kwargs = _worker_state
+    return _run_one(alembic, command, args, kwargs, url)
+
+
+def _run_one(
+    alembic: "Alembic",
+    command: str,
+    args: tuple,
+    kwargs: dict,
+    database: "str | SQLAlchemy",
+) -> DatabaseResult:
+    start = perf_counter()
+    owned = isinstance(database, str)
+    name = _get_url_name(database) if owned else _get_url_name(database.url)
+    db = None
+    try:
+        db = SQLAlchemy(database) if owned else database
+        alembic = copy.copy(alembic)
+        alembic.db = db
+        result = _to_result(getattr(alembic, command)(*args, **kwargs))
+        return DatabaseResult(name, result=result, duration=perf_counter() - start)
+    except Exception as error:
+        return DatabaseResult(
+            name, error=_to_result(error), duration=perf_counter() - start
+        )
+    finally:
+        if owned and db is not None:
+            db.engine.dispose()
+
+
+def _get_url_name(url: t.Any) -> str:
+    try:
+        return sa.make_url(url).render_as_string(hide_password=True)
+    except Exception:
+        return "<invalid URL>"
+
+
+def _to_result(value: t.Any) -> t.Any:
+    """Make the value safe to send back from another process."""
+    if isinstance(value, Script):
+        return value.revision
+    if isinstance(value, tuple) and all(isinstance(rev, Script) for rev in value):
+        return tuple(rev.revision for rev in value)
+    try:
+        pickle.dumps(value)
+    except Exception:
+        if isinstance(value, BaseException):
+            return RuntimeError(repr(value))
+        return repr(value)
+    return value
@@ -0,0 +1,173 @@
+import json
+import logging
+import time
+import typing as t
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+
+__all__ = ("backfill",)
+
+logger = logging.getLogger("sqla_wrapper")
+
+#: Table where the progress of each backfill is stored.
+PROGRESS_TABLE = "sqla_wrapper_backfills"
+
+
+def backfill(
+    table: "str | sa.Table",
+    values: t.Dict[str, t.Any],
+    *,
+    where: t.Any = None,
+    key: str = "id",
+    chunk_size: int = 1000,
+    rows_per_second: "float | None" = None,
+    name: "str | None" = None,
+    bind: "sa.Engine | sa.Connection | None" = None,
+    progress: "t.Callable[[int, t.Any], t.Any] | None" = None,
+) -> int:
+    """Update the rows of a big table in chunks of `chunk_size` rows,
+    ordered by `key`, committing after each one so the table is never
+    locked for long. Returns the number of rows updated.
+
+    Use it in the `upgrade()` of a revision, instead of a single `UPDATE`
+    of the whole table:
+
+    ```python
+    from sqla_wrapper import backfill
+
+    def upgrade():
+        op.add_column("users", sa.Column("full_name", sa.String(200)))
+        backfill(
+            "users",
+            {"full_name": sa.text("first_name || ' ' || last_name")},
+            where=sa.text("full_name IS NULL"),
+            rows_per_second=5000,
+        )
+    ```
+
+    Inside a migration, it runs the chunks in an alembic `autocommit_block()`,
+    which commits everything done before it in that transaction. Outside
+    one, give the engine (or connection) to use as `bind`.
+
+    The last key of each chunk done is saved in a table, so if the backfill
+    is interrupted, running it again continues where it stopped. That also
+    means that a chunk might run twice, so the update must be idempotent.
+
+    Args:
+        table: The table, or its name.
+        values: Dictionary of column names and the values (or SQL
+            expressions) to set.
+        where: Optional condition to update only some of the rows.
+        key: Name of a unique column to walk the table by, usually the
+            primary key.
+        chunk_size: Number of rows in each chunk.
+        rows_per_second: Optional maximum rate of rows updated. It sleeps
+            between chunks to stay below it.
+        name: Name for storing the progress. By default, the name of the
+            table and of the updated columns.
+        bind: The engine or connection to use, if this is not called
+            from a migration.
+        progress: Optional function called after each chunk with the
+            number of rows updated so far and the last key of the chunk.
+
+    """
+    if isinstance(table, str):
+        table = sa.table(table, sa.column(key), *[sa.column(col) for col in values])
+    name = name or f"{table.name}:{','.join(sorted(values))}"
+    key_column = table.c[key]
+
+    with _get_connection(bind) as (connection, commit):
+        progress_table = _get_progress_table(connection)
+        last_key = _get_last_key(connection, progress_table, name)
+        started = time.monotonic()
+        total = 0
+
+        while True:
+            # The key of the last row of the next chunk
+            query = sa.select(key_column).order_by(key_column)
+            if last_key is not None:
+                query = query.where(key_column > last_key)
+            if where is not None:
+                query = query.where(where)
+            upper = connection.scalar(query.offset(chunk_size - 1).limit(1))
+
+            stmt = sa.update(table).values(values)
+            if last_key is not None:
+                stmt = stmt.where(key_column > last_key)
+            if upper is not None:
+                stmt = stmt.where(key_column <= upper)
+            if where is not None:
+                stmt = stmt.where(where)
+            total += max(connection.execute(stmt).rowcount, 0)
+
+            if upper is None:
+                break
+            last_key = upper
+            _save_last_key(connection, progress_table, name, last_key)
+            commit()
+            logger.info("Backfill %s: %s rows updated", name, total)
+            if progress is not None:
+                progress(total, last_key)
+
+            if rows_per_second:
+                ahead = total / rows_per_second - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        connection.execute(
+            sa.delete(progress_table).where(progress_table.c.name == name)
+        )
+        commit()
+
+    logger.info("Backfill %s: done, %s rows updated", name, total)
+    if progress is not None:
+        progress(total, None)
+    return total
+
+
+@contextmanager
+def _get_connection(
+    bind: "sa.Engine | sa.Connection | None",
+) -> t.Iterator[t.Tuple[sa.Connection, t.Callable[[], None]]]:
+    """Yield a connection and the function to commit a chunk."""
+    if bind is None:
+        from alembic import op
+
+        context = op.get_context()
+        with context.autocommit_block():
+            # Every statement is committed by itself
+            yield context.connection, lambda: None
+    elif isinstance(bind, sa.Engine):
+        with bind.connect() as connection:
+            yield connection, connection.commit
+    else:
+        yield bind, bind.commit
+
+
+def _get_progress_table(connection: sa.Connection) -> sa.Table:
+    table = sa.Table(
+        PROGRESS_TABLE,
+        sa.MetaData(),
+        sa.Column("name", sa.String(255), primary_key=True),
+        sa.Column("last_key", sa.Text, nullable=False),
+    )
+    table.create(connection, checkfirst=True)
+    return table
+
+
+def _get_last_key(connection: sa.Connection, table: sa.Table, name: str) -> t.Any:
+    value = connection.scalar(sa.select(table.c.last_key).where(table.c.name == name))
+    return None if value is None else json.loads(value)
+
+
+def _save_last_key(
+    connection: sa.Connection, table: sa.Table, name: str, last_key: t.Any
+) -> None:
+    value = json.dumps(last_key, default=str)
+    updated = connection.execute(
+        sa.update(table).where(table.c.name == name).values(last_key=value)
+    )
+    if not updated.rowcount:
+        connection.execute(sa.insert(table).values(name=name, last_key=value))
@@ -1,18 +1,98 @@
 import typing as t
+from collections import namedtuple
 
-from sqlalchemy import inspect
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Mapper
 
 
 __all__ = ("BaseModel", )
 
 
 class BaseModel:
+    #: Names of attributes that are not mapped by SQLAlchemy (e.g.: plain
+    #: properties with a setter) but that `fill()` should also accept.
+    __fillable__: t.ClassVar[t.Iterable[str]] = ()
+
     def fill(self, **attrs: t.Any) -> t.Any:
-        """Fill the object with the values of the attrs dict."""
+        """Fill the object with the values of the attrs dict.
+
+        Raises an `AttributeError` if a name is not a mapped attribute of
+        the model (columns, relationships, hybrid properties, etc.), nor
+        one of the names listed in its `__fillable__` attribute.
+        """
+        cls = self.__class__
+        fillable = _get_model_info(cls).fillable
         for name in attrs:
+            if name not in fillable:
+                raise AttributeError(
+                    f"{cls.__name__!r} object has no attribute {name!r}"
+                )
             setattr(self, name, attrs[name])
         return self
 
+    def to_dict(
+        self,
+        only: "t.Iterable[str] | None" = None,
+        exclude: "t.Iterable[str] | None" = None,
+        relationships: "bool | t.Iterable[str]" = False,
+        unloaded: t.Any = None,
+    ) -> t.Dict[str, t.Any]:
+        """Return the values of the columns of the object as a dictionary.
+
+        The values are taken from what is already loaded: the attributes
+        that are not loaded (e.g.: deferred columns or lazy relationships)
+        get the `unloaded` value instead. The only exception are the columns
+        expired by a `commit()` or `expire()`, that are refreshed all
+        together in one query, as accessing any of them would do.
+        Dates and datetimes are converted to ISO 8601 strings.
+
+        **Example**:
+
+        ```python
+        user.to_dict(exclude=["password"], relationships=["addresses"])
+        ```
+
+        Args:
+            only: Optional list of the names to include.
+            exclude: Optional list of the names to leave out.
+            relationships: Also include the relationships; `True` for all
+                of them, or a list of names. The related objects are
+                converted without their own relationships.
+            unloaded: Value used for the attributes that are not loaded.
+
+        """
+        names, rels = _get_selection(self.__class__, only, exclude, relationships)
+        return _to_dict(self, names, rels, unloaded)
+
+    @classmethod
+    def to_dicts(
+        cls,
+        objs: t.Iterable[t.Any],
+        only: "t.Iterable[str] | None" = None,
+        exclude: "t.Iterable[str] | None" = None,
+        relationships: "bool | t.Iterable[str]" = False,
+        unloaded: t.Any = None,
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """Convert a list of objects of this model to dictionaries.
+        Takes the same arguments as `to_dict()`.
+
+        **Example**:
+
+        ```python
+        User.to_dicts(db.s.all(User), only=["id", "name"])
+        ```
+        """
+        names, rels = _get_selection(cls, only, exclude, relationships)
+        return [_to_dict(obj, names, rels, unloaded) for obj in objs]
+
+    @classmethod
+    def from_dict(cls, data: t.Dict[str, t.Any]) -> t.Any:
+        """Create a new object filled with the values of the data dict.
+
+        Raises an `AttributeError` if a key is not an attribute of the model.
+        """
+        return cls().fill(**data)
+
     def __repr__(self) -> str:
         output = ["<", self.__class__.__name__, f" #{id(self)}"]
         for attr in self._iter_attrs():
@@ -21,11 +101,7 @@ class BaseModel:
         return "".join(output)
 
     def _iter_attrs(self) -> t.Generator:
-        inspection = inspect(self.__class__)
-        if inspection is None:
-            raise StopIteration
-        names = inspection.columns.keys()
-        for name in names:
+        for name in _get_model_info(self.__class__).columns:
             yield (name, getattr(self, name))
 
     def _repr_attr(self, attr: t.Any) -> str:
@@ -35,3 +111,169 @@ class BaseModel:
         else:
             value = repr(value)
         return f"{name} = {value}"
+
+
+class _ModelInfo:
+    """The attribute names of a model class, so they don't have to be
+    looked up through its mapper every time they are needed.
+    """
+
+    __slots__ = (
+        "columns",
+        "relationships",
+        "names",
+        "fillable",
+        "generation",
+        "selections",
+        "records",
+    )
+
+    def __init__(self, cls: t.Any) -> None:
+        mapper = inspect(cls, raiseerr=False)
+        if mapper is None:
+            self.columns: t.Tuple[str, ...] = ()
+            self.relationships: t.Tuple[str, ...] = ()
+            self.names: t.FrozenSet[str] = frozenset()
+        else:
+            # This configures the mappers if needed
+            self.names = frozenset(mapper.all_orm_descriptors.keys())
+            self.columns = tuple(mapper.columns.keys())
+            self.relationships = tuple(mapper.relationships.keys())
+        self.fillable = self.names | frozenset(getattr(cls, "__fillable__", ()))
+        self.generation = _configured
+        # The names selected by each combination of `to_dict()` arguments
+        self.selections: t.Dict[t.Any, t.Tuple[t.Tuple[str, ...], ...]] = {}
+        # The record classes of `get_record_class()`, by column names
+        self.records: t.Dict[t.Tuple[str, ...], t.Any] = {}
+
+
+# Incremented each time new mappers are configured, because they can add
+# attributes (e.g.: backrefs) to models that were already configured.
+_configured = 0
+
+
+def _get_model_info(cls: t.Any) -> _ModelInfo:
+    # Looked up in the class `__dict__` so a subclass doesn't use the
+    # info of its parent.
+    info = cls.__dict__.get("_sqla_wrapper_info")
+    if info is None or info.generation != _configured:
+        info = _ModelInfo(cls)
+        cls._sqla_wrapper_info = info
+    return info
+
+
+def get_record_class(
+    Model: t.Any, names: "t.Sequence[str] | None" = None
+) -> t.Any:
+    """Return a named tuple class with the names of the columns of the model,
+    or just the given ones, to store the values of a row.
+
+    The classes are cached, so the same one is returned for the same
+    model and names.
+    """
+    info = _get_model_info(Model)
+    key = info.columns if names is None else tuple(names)
+    Record = info.records.get(key)
+    if Record is None:
+        for name in key:
+            if name not in info.columns:
+                raise AttributeError(
+                    f"{Model.__name__!r} has no column {name!r}"
+                )
+        # Names that can't be fields (e.g.: starting with "_") are renamed
+        # to their position, so `_columns` keeps the original ones.
+        Record = namedtuple(  # type: ignore
+            f"{Model.__name__}Record", key, rename=True
+        )
+        Record._columns = key
+        info.records[key] = Record
+    return Record
+
+
+def _get_selection(
+    cls: t.Any,
+    only: "t.Iterable[str] | None",
+    exclude: "t.Iterable[str] | None",
+    relationships: "bool | t.Iterable[str]",
+) -> t.Tuple[t.Tuple[str, ...], ...]:
+    info = _get_model_info(cls)
+    key = (
+        None if only is None else tuple(only),
+        None if exclude is None else tuple(exclude),
+        relationships if isinstance(relationships, bool) else tuple(relationships),
+    )
+    selection = info.selections.get(key)
+    if selection is not None:
+        return selection
+
+    only_, exclude_, rels = key
+    if rels is True:
+        rels = info.relationships
+    elif rels is False:
+        rels = ()
+    for name in (only_ or ()) + (exclude_ or ()) + rels:
+        if name not in info.names:
+            raise AttributeError(f"{cls.__name__!r} has no attribute {name!r}")
+
+    columns = info.columns
+    if only_ is not None:
+        columns = tuple(name for name in columns if name in only_)
+        rels = tuple(name for name in rels if name in only_)
+    if exclude_:
+        columns = tuple(name for name in columns if name not in exclude_)
+        rels = tuple(name for name in rels if name not in exclude_)
+
+    selection = info.selections[key] = (columns, rels)
+    return selection
+
+
+def _to_dict(
+    obj: t.Any,
+    names: t.Tuple[str, ...],
+    rels: t.Tuple[str, ...],
+    unloaded: t.Any,
+) -> t.Dict[str, t.Any]:
+    _refresh_expired(obj, names)
+    # Reading the instance `__dict__` directly skips the attribute
+    # instrumentation and never triggers a lazy load.
+    values = obj.__dict__
+    data = {}
+    for name in names:
+        value = values.get(name, unloaded)
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        data[name] = value
+
+    for name in rels:
+        if name not in values:
+            data[name] = unloaded
+            continue
+        value = values[name]
+        if value is None:
+            data[name] = None
+        elif isinstance(value, BaseModel):
+            data[name] = value.to_dict(unloaded=unloaded)
+        elif isinstance(value, dict):
+            data[name] = {
+                key: item.to_dict(unloaded=unloaded) for key, item in value.items()
+            }
+        else:
+            data[name] = [item.to_dict(unloaded=unloaded) for item in value]
+    return data
+
+
+def _refresh_expired(obj: t.Any, names: t.Tuple[str, ...]) -> None:
+    state = inspect(obj, raiseerr=False)
+    if state is None or not state.expired_attributes or not state.persistent:
+        return
+    for name in names:
+        if name in state.expired_attributes:
+            # Loads every expired attribute, not only this one
+            getattr(obj, name)
+            return
+
+
+@event.listens_for(Mapper, "after_configured")
+def _after_configured() -> None:
+    global _configured
+    _configured += 1
@@ -0,0 +1,224 @@
+import asyncio
+import typing as t
+
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm.util import identity_key
+
+
+if t.TYPE_CHECKING:
+    from .session import Session
+
+
+__all__ = ("BatchLoader", "Load")
+
+# Maximum number of values in each `IN (...)` of the queries
+CHUNK_SIZE = 500
+
+_GroupKey = t.Tuple[t.Any, str, bool]
+
+
+class Load:
+    """The pending result of a `BatchLoader.load()` call.
+
+    Call `result()` to get the value, dispatching the pending lookups
+    first if needed, or `await` it inside a coroutine.
+    """
+
+    __slots__ = ("loader", "value", "error", "done", "future")
+
+    def __init__(self, loader: "BatchLoader") -> None:
+        self.loader = loader
+        self.value: t.Any = None
+        self.error: "BaseException | None" = None
+        self.done = False
+        self.future: "asyncio.Future | None" = None
+
+    def result(self) -> t.Any:
+        if not self.done:
+            self.loader.dispatch()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def __await__(self) -> t.Generator[t.Any, None, t.Any]:
+        if not self.done and self.future is not None:
+            yield from self.future.__await__()
+        return self.result()
+
+    def _resolve(self, value: t.Any, error: "BaseException | None" = None) -> None:
+        self.value = value
+        self.error = error
+        self.done = True
+        future = self.future
+        if future is not None and not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+
+class BatchLoader:
+    """Collects lookups of objects by a column and runs them together, as
+    one `SELECT ... WHERE column IN (...)` query for each model and column.
+
+    The lookups are run when the result of any of them is needed, when
+    `dispatch()` is called or, inside a running asyncio event loop, at the
+    end of the current loop iteration. The results are remembered until the
+    session is closed or rolled back, so asking again for the same key
+    doesn't run a query.
+
+    Every `sqla_wrapper.Session` has one, used through `db.s.load()`,
+    `db.s.load_all()` and `db.s.dispatch_loads()`:
+
+    ```python
+    authors = [db.s.load(User, post.author_id) for post in posts]
+    comments = [db.s.load(Comment, post.id, column="post_id", many=True)
+                for post in posts]
+    db.s.dispatch_loads()  # Two queries in total
+    authors[0].result()
+    ```
+
+    Args:
+        session: The session used to run the queries.
+
+    """
+
+    def __init__(self, session: "Session") -> None:
+        self.session = session
+        self._pending: t.Dict[_GroupKey, t.Dict[t.Any, Load]] = {}
+        self._memo: t.Dict[_GroupKey, t.Dict[t.Any, t.Any]] = {}
+        self._scheduled = False
+
+    def load(
+        self,
+        Model: t.Any,
+        key: t.Any,
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> Load:
+        """Ask for the object of `Model` with this value of the primary key,
+        or of another `column`. With `many=True`, ask for the list of all
+        the objects with that value instead (e.g.: by a foreign key).
+
+        The result is `None` (or an empty list with `many=True`) if there
+        are no matching objects.
+        """
+        group = (Model, column or _get_pk_name(Model), many)
+        load = Load(self)
+
+        memo = self._memo.get(group)
+        if memo is not None and key in memo:
+            load._resolve(memo[key])
+            return load
+        if column is None and not many:
+            obj = self.session.identity_map.get(identity_key(Model, key))
+            if obj is not None:
+                load._resolve(obj)
+                return load
+
+        pending = self._pending.setdefault(group, {})
+        if key in pending:
+            return pending[key]
+        pending[key] = load
+        self._schedule(load)
+        return load
+
+    def load_all(
+        self,
+        Model: t.Any,
+        keys: t.Iterable[t.Any],
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> t.List[Load]:
+        """Like `load()` for each one of the keys."""
+        return [self.load(Model, key, column=column, many=many) for key in keys]
+
+    def dispatch(self) -> None:
+        """Run the queries of all the pending lookups.
+
+        If a query fails, the lookups of the other groups are still run,
+        and the first error is raised at the end.
+        """
+        self._scheduled = False
+        first_error: "Exception | None" = None
+        while self._pending:
+            group, pending = self._pending.popitem()
+            try:
+                found = self._fetch(group, list(pending))
+            except BaseException as error:
+                for load in pending.values():
+                    load._resolve(None, error)
+                if not isinstance(error, Exception):
+                    raise
+                if first_error is None:
+                    first_error = error
+                continue
+            memo = self._memo.setdefault(group, {})
+            empty = [] if group[2] else None
+            for key, load in pending.items():
+                value = found.get(key, empty)
+                memo[key] = value
+                load._resolve(value)
+        if first_error is not None:
+            raise first_error
+
+    def clear(self) -> None:
+        """Forget the results of the previous lookups and cancel the
+        pending ones, that fail with an `InvalidRequestError`.
+        """
+        self._memo.clear()
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        error = InvalidRequestError(
+            "The session was closed or rolled back before the lookup ran"
+        )
+        for loads in pending.values():
+            for load in loads.values():
+                load._resolve(None, error)
+
+    def _fetch(self, group: _GroupKey, keys: t.List[t.Any]) -> t.Dict[t.Any, t.Any]:
+        Model, column, many = group
+        attr = getattr(Model, column)
+        found: t.Dict[t.Any, t.Any] = {}
+        for start in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[start:start + CHUNK_SIZE]
+            stmt = select(Model).where(attr.in_(chunk))
+            for obj in self.session.execute(stmt).scalars():
+                value = getattr(obj, column)
+                if many:
+                    found.setdefault(value, []).append(obj)
+                else:
+                    found.setdefault(value, obj)
+        return found
+
+    def _schedule(self, load: Load) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        load.future = loop.create_future()
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch_soon)
+
+    def _dispatch_soon(self) -> None:
+        # The errors are already stored in the `Load` objects
+        try:
+            self.dispatch()
+        except Exception:
+            pass
+
+
+def _get_pk_name(Model: t.Any) -> str:
+    mapper = inspect(Model)
+    if len(mapper.primary_key) != 1:
+        raise ValueError(
+            f"{Model.__name__!r} has a composite primary key, use `column=` "
+            "to load it by another column"
+        )
+    return mapper.get_property_by_column(mapper.primary_key[0]).key
@@ -25,11 +25,50 @@ def _get_cli(alembic, group):
         "--parent", default=None,
         help="Parent revision of this new revision.",
     )
-    def revision(message, empty, parent):
+    @click.option(
+        "-t", "--table", "tables", multiple=True,
+        help="Compare only this table. Can be repeated and use * wildcards.",
+    )
+    @click.option(
+        "-s", "--schema", "schemas", multiple=True,
+        help="Compare only the tables of this schema. Can be repeated.",
+    )
+    def revision(message, empty, parent, tables, schemas):
         """Create a new revision.
         Auto-generate operations by comparing models and database.
         """
-        alembic.revision(message, empty=empty, parent=parent)
+        alembic.revision(
+            message,
+            empty=empty,
+            parent=parent,
+            include_tables=tables or None,
+            include_schemas=schemas or None,
+        )
+
+    @group.command()
+    @click.option(
+        "-t", "--table", "tables", multiple=True,
+        help="Compare only this table. Can be repeated and use * wildcards.",
+    )
+    @click.option(
+        "-s", "--schema", "schemas", multiple=True,
+        help="Compare only the tables of this schema. Can be repeated.",
+    )
+    def check(tables, schemas):
+        """Check if the database matches the models.
+        Exits with an error if it doesn't.
+        """
+        changes = alembic.check(
+            include_tables=tables or None,
+            include_schemas=schemas or None,
+        )
+        if not changes:
+            click.echo("The database matches the models.")
+            return
+        for change in changes:
+            click.echo(str(change))
+        click.echo(f"{len(changes)} difference(s) with the models.")
+        raise click.exceptions.Exit(1)
 
     @group.command()
     @click.argument("target", default="head")
@@ -39,7 +78,28 @@ def _get_cli(alembic, group):
     )
     def upgrade(target, sql):
         """Run migrations to upgrade database."""
-        alembic.upgrade(target, sql=sql)
+        report = alembic.upgrade(target, sql=sql, progress=click.echo)
+        _echo_report(report)
+
+    @group.command()
+    @click.argument("urls", nargs=-1, required=True)
+    @click.option(
+        "-t", "--target", default="head",
+        help="Revision target.",
+    )
+    @click.option(
+        "-w", "--workers", default=4, show_default=True,
+        help="Maximum number of databases migrated at the same time.",
+    )
+    def upgrade_many(urls, target, workers):
+        """Run migrations to upgrade many databases, given by their URLs."""
+        results = alembic.upgrade_many(urls, target, workers=workers)
+        for result in results:
+            click.echo(str(result))
+        failed = sum(1 for result in results if not result.ok)
+        click.echo(f"{len(results) - failed} upgraded, {failed} failed.")
+        if failed:
+            raise click.exceptions.Exit(1)
 
     @group.command()
     @click.argument("target", default="-1")
@@ -49,7 +109,8 @@ def _get_cli(alembic, group):
     )
     def downgrade(target, sql):
         """Revert to a previous version"""
-        alembic.downgrade(target, sql=sql)
+        report = alembic.downgrade(target, sql=sql, progress=click.echo)
+        _echo_report(report)
 
     @group.command()
     @click.option(
@@ -103,6 +164,18 @@ def _get_cli(alembic, group):
         """Print the latest revision(s)."""
         alembic.head(verbose=verbose)
 
+    @group.command()
+    @click.argument("up_to")
+    @click.option(
+        "--scratch-url", default=None,
+        help="URL of an empty database to run the revisions on.",
+    )
+    def squash(up_to, scratch_url):
+        """Replace all the revisions up to UP_TO (including it)
+        with a single baseline revision.
+        """
+        alembic.squash(up_to, scratch_url=scratch_url)
+
     @group.command()
     @click.argument("path", default=None)
     def init(path):
@@ -120,3 +193,16 @@ def _get_cli(alembic, group):
         alembic.create_all()
 
     return group
+
+
+def _echo_report(report):
+    import click
+
+    if report is None:
+        return
+    if not report.steps:
+        click.echo("Nothing to do.")
+        return
+    click.echo(
+        f"{len(report.steps)} revision(s) in {report.duration:.2f}s"
+    )
@@ -1,8 +1,32 @@
+import sys
 
 
 def get_proper_cli(alembic):
     import proper_cli  # type: ignore
 
+    def upgrade_many(self, *urls, target="head", workers=4):
+        """Run migrations to upgrade many databases, given by their URLs."""
+        results = alembic.upgrade_many(urls, target, workers=int(workers))
+        for result in results:
+            print(result)
+        failed = sum(1 for result in results if not result.ok)
+        print(f"{len(results) - failed} upgraded, {failed} failed.")
+        if failed:
+            sys.exit(1)
+
+    def check(self):
+        """Check if the database matches the models.
+        Exits with an error if it doesn't.
+        """
+        changes = alembic.check()
+        if not changes:
+            print("The database matches the models.")
+            return
+        for change in changes:
+            print(change)
+        print(f"{len(changes)} difference(s) with the models.")
+        sys.exit(1)
+
     return type(
         "DBCli",
         (proper_cli.Cli,),
@@ -11,9 +35,12 @@ def get_proper_cli(alembic):
 
             "revision": alembic.revision,
             "upgrade": alembic.upgrade,
+            "upgrade_many": upgrade_many,
+            "check": check,
             "downgrade": alembic.downgrade,
             "history": alembic.history,
             "stamp": alembic.stamp,
+            "squash": alembic.squash,
             "head": alembic.head,
             "current": alembic.current,
             "init": alembic.init,
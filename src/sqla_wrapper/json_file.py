@@ -0,0 +1,40 @@
+import json
+import os
+import typing as t
+from contextlib import suppress
+from pathlib import Path
+
+
+__all__ = ("read_json", "write_json")
+
+
+def read_json(path: Path) -> t.Any:
+    """Return the content of a JSON file, or `None` if it doesn't exist
+    or can't be read.
+    """
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: Path, data: t.Any) -> None:
+    """Write `data` to a JSON file, creating its folder if needed.
+
+    The data is written to a temporary file first, unique to this process,
+    and then moved in place, so other processes never read a half-written
+    file and concurrent writers don't mix their contents.
+
+    Raises `TypeError` if the data can't be serialized (before touching the
+    file) or `OSError` if the file can't be written.
+    """
+    content = json.dumps(data)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        tmp_path.write_text(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        with suppress(OSError):
+            tmp_path.unlink()
+        raise
@@ -0,0 +1,316 @@
+import typing as t
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import event as sa_event
+
+from .session import ContextVarRegistry
+from .sqlalchemy_wrapper import SQLAlchemy
+
+
+__all__ = ("ASGIMiddleware", "RequestStats", "WSGIMiddleware")
+
+_current_stats: "ContextVar[RequestStats | None]" = ContextVar(
+    "sqla_wrapper_request_stats", default=None
+)
+
+
+class RequestStats:
+    """Database usage during a request."""
+
+    __slots__ = ("db_time", "queries", "checkout_wait")
+
+    def __init__(self) -> None:
+        #: Seconds spent executing statements.
+        self.db_time = 0.0
+        #: Number of statements executed.
+        self.queries = 0
+        #: Seconds spent waiting for a connection from the pool.
+        self.checkout_wait = 0.0
+
+    def server_timing(self) -> str:
+        """Format the stats as the value of a `Server-Timing` header."""
+        return (
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+            f"db-wait;dur={self.checkout_wait * 1000:.2f}"
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<RequestStats db_time={self.db_time:.4f} queries={self.queries}"
+            f" checkout_wait={self.checkout_wait:.4f}>"
+        )
+
+
+class _SessionLifecycle:
+    def __init__(
+        self,
+        app: t.Any,
+        db: SQLAlchemy,
+        *,
+        server_timing: bool = True,
+        callback: "t.Callable[[RequestStats], t.Any] | None" = None,
+    ) -> None:
+        self.app = app
+        self.db = db
+        self.server_timing = server_timing
+        self.callback = callback
+        _instrument(db)
+
+    def _start(self) -> t.Any:
+        # The session is created before calling the application, so any
+        # copy of the context made from here on (e.g.: to run code in a
+        # thread pool) shares it.
+        self.db.s()
+        return _current_stats.set(RequestStats())
+
+    def _finish(self, status: int) -> None:
+        """Commit if the response is successful, rollback otherwise."""
+        session = self.db.s()
+        if status < 400:
+            try:
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        else:
+            session.rollback()
+
+    def _end(self, token: t.Any) -> None:
+        stats = _current_stats.get()
+        try:
+            self.db.s.remove()
+        finally:
+            _current_stats.reset(token)
+        if self.callback and stats is not None:
+            self.callback(stats)
+
+
+class WSGIMiddleware(_SessionLifecycle):
+    """WSGI middleware that manages the scoped session `db.s` of each request.
+
+    The session is committed, if the response status is lower than 400,
+    or rolled back otherwise (or if there was an error), right before the
+    headers are sent, and removed after the response has been sent.
+
+    It also records the time spent executing statements, the number
+    of statements, and the time waiting for a connection from the pool.
+    These are added as a `Server-Timing` header and/or sent to a callback.
+
+    **Example**:
+
+    ```python
+    app.wsgi_app = WSGIMiddleware(app.wsgi_app, db, callback=log_db_stats)
+    ```
+
+    Args:
+        app: The WSGI application.
+        db: A `sqla_wrapper.SQLAlchemy` instance.
+        server_timing: Add a `Server-Timing` header to the responses.
+        callback: Optional function called with a `RequestStats` object
+            at the end of each request.
+
+    """
+
+    def __call__(
+        self, environ: t.Dict[str, t.Any], start_response: t.Callable
+    ) -> t.Any:
+        token = self._start()
+        response = _WSGIResponse(self, start_response, token)
+        try:
+            response.iterable = self.app(environ, response.start_response)
+        except BaseException:
+            response.close()
+            raise
+        return response
+
+
+class ASGIMiddleware(_SessionLifecycle):
+    """ASGI middleware that manages the scoped session `db.s` of each request.
+
+    The session is committed, if the response status is lower than 400,
+    or rolled back otherwise (or if there was an error), right before
+    the response starts, and removed at the end of the request.
+
+    It also records the time spent executing statements, the number
+    of statements, and the time waiting for a connection from the pool.
+    These are added as a `Server-Timing` header and/or sent to a callback.
+
+    Concurrent requests might run in the same thread, so the `SQLAlchemy`
+    instance must use `session_scope="context"`, or a `ValueError` is
+    raised. The asyncio tasks created while handling a request share its
+    session, so use `with db.s.scope():` in those that run concurrently.
+
+    **Example**:
+
+    ```python
+    db = SQLAlchemy(database_uri, session_scope="context")
+    app = ASGIMiddleware(app, db, callback=log_db_stats)
+    ```
+
+    Args:
+        app: The ASGI application.
+        db: A `sqla_wrapper.SQLAlchemy` instance.
+        server_timing: Add a `Server-Timing` header to the responses.
+        callback: Optional function called with a `RequestStats` object
+            at the end of each request.
+
+    """
+
+    def __init__(
+        self,
+        app: t.Any,
+        db: SQLAlchemy,
+        *,
+        server_timing: bool = True,
+        callback: "t.Callable[[RequestStats], t.Any] | None" = None,
+    ) -> None:
+        if not isinstance(db.s.registry, ContextVarRegistry):
+            raise ValueError(
+                "ASGIMiddleware requires a SQLAlchemy instance created with "
+                "session_scope='context', or concurrent requests would share "
+                "the same session"
+            )
+        super().__init__(app, db, server_timing=server_timing, callback=callback)
+
+    async def __call__(
+        self, scope: t.Dict[str, t.Any], receive: t.Callable, send: t.Callable
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = self._start()
+        finished = False
+
+        async def wrapped_send(message: t.Dict[str, t.Any]) -> None:
+            nonlocal finished
+            if message["type"] == "http.response.start":
+                finished = True
+                self._finish(message["status"])
+                if self.server_timing:
+                    stats = _current_stats.get()
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", stats.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped_send)
+        except BaseException:
+            if not finished:
+                self.db.s().rollback()
+            raise
+        finally:
+            self._end(token)
+
+
+class _WSGIResponse:
+    """Wraps the response of a WSGI application to finish the session once
+    the status is known, right before sending the headers: when the first
+    non-empty part of the body is ready, when the `write()` callable is
+    first used, or at the end of an empty body.
+
+    The application can call `start_response()` late, e.g.: a generator
+    doesn't call it until the server starts iterating it.
+    """
+
+    def __init__(
+        self, middleware: WSGIMiddleware, start_response: t.Callable, token: t.Any
+    ) -> None:
+        self.middleware = middleware
+        self.iterable: t.Iterable = ()
+        self.token = token
+        self._start_response = start_response
+        self._response_start: t.List[t.Any] = []
+        self._write: "t.Callable | None" = None
+        self._finished = False
+        self._closed = False
+
+    def start_response(self, status, headers, exc_info=None) -> t.Callable:
+        if self._write is not None:
+            # Already sent, so this re-raises `exc_info`
+            return self._start_response(status, headers, exc_info)
+        self._response_start[:] = [status, headers, exc_info]
+        return self.write
+
+    def write(self, data: bytes) -> None:
+        # The (deprecated) `write()` callable requires the headers
+        # to be sent first.
+        self.send_headers()(data)
+
+    def send_headers(self) -> t.Callable:
+        if self._write is None:
+            if not self._response_start:
+                raise RuntimeError("The application didn't call `start_response()`")
+            self.finish()
+            status, headers, exc_info = self._response_start
+            if self.middleware.server_timing:
+                stats = _current_stats.get()
+                if stats is not None:
+                    headers = headers + [("Server-Timing", stats.server_timing())]
+            self._write = self._start_response(status, headers, exc_info)
+        return self._write
+
+    def finish(self) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        status = int(str(self._response_start[0]).split(" ", 1)[0])
+        self.middleware._finish(status)
+
+    def __iter__(self) -> t.Iterator:
+        for chunk in self.iterable:
+            if self._write is None and (chunk or self._response_start):
+                self.send_headers()
+            yield chunk
+        self.send_headers()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self.iterable, "close", None)
+            if close is not None:
+                close()
+        finally:
+            try:
+                # The response failed or was interrupted
+                if not self._finished:
+                    self._finished = True
+                    self.middleware.db.s().rollback()
+            finally:
+                self.middleware._end(self.token)
+
+
+def _instrument(db: SQLAlchemy) -> None:
+    for engine in db._iter_engines():
+        if not sa_event.contains(
+            engine, "before_cursor_execute", _before_cursor_execute
+        ):
+            sa_event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            sa_event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    for monitor in db.pool_monitors.values():
+        if _add_checkout_wait not in monitor.wait_listeners:
+            monitor.wait_listeners.append(_add_checkout_wait)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats.get() is not None:
+        conn.info.setdefault("sqla_wrapper_query_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    starts = conn.info.get("sqla_wrapper_query_start")
+    if stats is None or not starts:
+        return
+    stats.db_time += perf_counter() - starts.pop()
+    stats.queries += 1
+
+
+def _add_checkout_wait(elapsed: float) -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.checkout_wait += elapsed
@@ -0,0 +1,136 @@
+import time
+import typing as t
+import zlib
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+__all__ = ("migration_lock",)
+
+# Seconds between attempts to get a lock that is taken
+POLL_INTERVAL = 0.2
+
+
+@contextmanager
+def migration_lock(
+    engine: sa.Engine, name: str, timeout: "float | None" = None
+) -> t.Iterator[None]:
+    """Hold a lock, shared by every process using the same database, while
+    running the block. Use it to stop several instances of an application
+    from running the migrations at the same time.
+
+    It uses an advisory lock on PostgreSQL, `GET_LOCK()` on MySQL/MariaDB,
+    and a lock file next to the database file on SQLite. With other
+    databases, or an in-memory SQLite, there is no lock.
+
+    Args:
+        engine: The engine of the database.
+        name: Name of the lock.
+        timeout: Maximum seconds to wait for the lock, or `None` to wait
+            forever. Raises a `TimeoutError` if it runs out.
+
+    """
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        lock = _postgresql_lock
+    elif dialect in ("mysql", "mariadb"):
+        lock = _mysql_lock
+    elif dialect == "sqlite":
+        lock = _sqlite_lock
+    else:
+        lock = _no_lock
+    with lock(engine, name, timeout):
+        yield
+
+
+@contextmanager
+def _postgresql_lock(
+    engine: sa.Engine, name: str, timeout: "float | None"
+) -> t.Iterator[None]:
+    # Advisory locks are identified by a 64-bit integer
+    key = zlib.crc32(name.encode())
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        _poll(
+            lambda: connection.scalar(
+                sa.text("SELECT pg_try_advisory_lock(:key)"), {"key": key}
+            ),
+            name,
+            timeout,
+        )
+        try:
+            yield
+        finally:
+            connection.execute(
+                sa.text("SELECT pg_advisory_unlock(:key)"), {"key": key}
+            )
+
+
+@contextmanager
+def _mysql_lock(
+    engine: sa.Engine, name: str, timeout: "float | None"
+) -> t.Iterator[None]:
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        # A negative timeout means waiting forever
+        acquired = connection.scalar(
+            sa.text("SELECT GET_LOCK(:name, :timeout)"),
+            {"name": name[:64], "timeout": -1 if timeout is None else timeout},
+        )
+        if acquired != 1:
+            raise TimeoutError(f"Timed out waiting for the lock {name!r}")
+        try:
+            yield
+        finally:
+            connection.execute(
+                sa.text("SELECT RELEASE_LOCK(:name)"), {"name": name[:64]}
+            )
+
+
+@contextmanager
+def _sqlite_lock(
+    engine: sa.Engine, name: str, timeout: "float | None"
+) -> t.Iterator[None]:
+    database = engine.url.database
+    if fcntl is None or not database or database == ":memory:":
+        yield
+        return
+
+    with open(f"{database}.{name}.lock", "w") as lockfile:
+
+        def try_lock() -> bool:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+
+        _poll(try_lock, name, timeout)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _no_lock(
+    engine: sa.Engine, name: str, timeout: "float | None"
+) -> t.Iterator[None]:
+    yield
+
+
+def _poll(
+    try_lock: t.Callable[[], t.Any], name: str, timeout: "float | None"
+) -> None:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not try_lock():
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out waiting for the lock {name!r}")
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,217 @@
+import typing as t
+from time import perf_counter
+
+import sqlalchemy as sa
+
+
+__all__ = ("DatabaseResult", "MigrationReport", "MigrationStep", "SchemaChange")
+
+
+class MigrationStep:
+    """What happened when a revision was applied (or reverted)."""
+
+    __slots__ = ("revision", "doc", "is_upgrade", "duration", "statements", "rows")
+
+    def __init__(
+        self,
+        revision: str,
+        doc: str,
+        *,
+        is_upgrade: bool,
+        duration: float,
+        statements: int,
+        rows: int,
+    ) -> None:
+        #: Id of the revision.
+        self.revision = revision
+        #: First line of the docstring of the revision.
+        self.doc = doc
+        #: `False` if the revision was reverted.
+        self.is_upgrade = is_upgrade
+        #: Seconds it took.
+        self.duration = duration
+        #: Number of statements executed.
+        self.statements = statements
+        #: Number of rows affected, as reported by the database driver.
+        self.rows = rows
+
+    def __str__(self) -> str:
+        action = "Upgraded to" if self.is_upgrade else "Reverted"
+        return (
+            f"{action} {self.revision} {self.doc} in {self.duration:.2f}s"
+            f" ({self.statements} statements, {self.rows} rows)"
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<MigrationStep {self.revision} duration={self.duration:.4f}"
+            f" statements={self.statements} rows={self.rows}>"
+        )
+
+
+class MigrationReport:
+    """The steps run by `Alembic.upgrade()` or `Alembic.downgrade()`,
+    with their timings.
+    """
+
+    def __init__(self) -> None:
+        #: List of `MigrationStep`, in the order they were run.
+        self.steps: t.List[MigrationStep] = []
+        #: Total seconds it took.
+        self.duration = 0.0
+
+    def slowest(self, count: int = 5) -> t.List[MigrationStep]:
+        """Return the `count` steps that took longer."""
+        return sorted(self.steps, key=lambda step: step.duration, reverse=True)[:count]
+
+    def __repr__(self) -> str:
+        return f"<MigrationReport steps={len(self.steps)} duration={self.duration:.4f}>"
+
+
+class DatabaseResult:
+    """The outcome of running a command on one of the databases of
+    `Alembic.run_many()`.
+    """
+
+    __slots__ = ("database", "result", "error", "duration")
+
+    def __init__(
+        self,
+        database: str,
+        *,
+        result: t.Any = None,
+        error: "BaseException | None" = None,
+        duration: float = 0.0,
+    ) -> None:
+        #: URL of the database, without the password.
+        self.database = database
+        #: What the command returned.
+        self.result = result
+        #: The exception raised by the command, if it failed.
+        self.error = error
+        #: Seconds it took.
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __str__(self) -> str:
+        status = "OK" if self.ok else f"FAILED: {self.error!r}"
+        return f"{self.database}: {status} ({self.duration:.2f}s)"
+
+    def __repr__(self) -> str:
+        return f"<DatabaseResult {self}>"
+
+
+class SchemaChange:
+    """A difference between the models and the database, found by
+    `Alembic.check()`.
+    """
+
+    __slots__ = ("action", "table", "name", "old", "new")
+
+    def __init__(
+        self,
+        action: str,
+        table: "str | None",
+        name: "str | None" = None,
+        *,
+        old: t.Any = None,
+        new: t.Any = None,
+    ) -> None:
+        #: What should be done to the database to match the models, as named
+        #: by alembic, e.g.: "add_column", "remove_index" or "modify_type".
+        self.action = action
+        #: Name of the table, with its schema if it isn't the default one.
+        self.table = table
+        #: Name of the column, index or constraint, if the change is about one.
+        self.name = name
+        #: For the "modify_*" actions, the value in the database.
+        self.old = old
+        #: For the "modify_*" actions, the value in the models.
+        self.new = new
+
+    @classmethod
+    def from_diff(cls, diff: t.Sequence[t.Any]) -> "SchemaChange":
+        """Make it from one of the tuples of alembic's `compare_metadata()`."""
+        action = diff[0]
+        if action.startswith("modify_"):
+            # (action, schema, table, column, existing, old, new)
+            return cls(
+                action,
+                _qualify(diff[1], diff[2]),
+                diff[3],
+                old=diff[5],
+                new=diff[6],
+            )
+        if action in ("add_column", "remove_column"):
+            return cls(action, _qualify(diff[1], diff[2]), diff[3].name)
+        obj = diff[1]
+        if isinstance(obj, sa.Table):
+            return cls(action, obj.fullname)
+        table = getattr(obj, "table", None)
+        return cls(
+            action,
+            table.fullname if table is not None else None,
+            getattr(obj, "name", None),
+        )
+
+    def __str__(self) -> str:
+        target = ".".join(part for part in (self.table, self.name) if part)
+        text = f"{self.action} {target}"
+        if self.action.startswith("modify_"):
+            text += f": {self.old!r} -> {self.new!r}"
+        return text
+
+    def __repr__(self) -> str:
+        return f"<SchemaChange {self}>"
+
+
+def _qualify(schema: "str | None", table: str) -> str:
+    return f"{schema}.{table}" if schema else table
+
+
+class _StepRecorder:
+    """Connection and alembic callbacks that fill a `MigrationReport`."""
+
+    def __init__(
+        self,
+        report: MigrationReport,
+        callback: "t.Callable[[MigrationStep], t.Any] | None" = None,
+    ) -> None:
+        self.report = report
+        self.callback = callback
+        self.started = self.step_started = perf_counter()
+        self.statements = 0
+        self.rows = 0
+
+    def before_cursor_execute(self, conn, cursor, statement, *args) -> None:
+        self.statements += 1
+
+    def after_cursor_execute(self, conn, cursor, statement, *args) -> None:
+        # -1 when the driver doesn't know or it doesn't apply
+        rowcount = getattr(cursor, "rowcount", -1)
+        if rowcount and rowcount > 0:
+            self.rows += rowcount
+
+    def on_version_apply(self, *, ctx, step, heads, run_args) -> None:
+        now = perf_counter()
+        revision = step.up_revision
+        doc = revision.doc if revision is not None else ""
+        migration_step = MigrationStep(
+            step.up_revision_id,
+            doc,
+            is_upgrade=step.is_upgrade,
+            duration=now - self.step_started,
+            statements=self.statements,
+            rows=self.rows,
+        )
+        self.report.steps.append(migration_step)
+        self.step_started = now
+        self.statements = self.rows = 0
+        if self.callback is not None:
+            self.callback(migration_step)
+
+    def finish(self) -> None:
+        self.report.duration = perf_counter() - self.started
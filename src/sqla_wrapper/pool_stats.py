@@ -0,0 +1,220 @@
+import functools
+import logging
+import threading
+import typing as t
+from time import monotonic, perf_counter
+
+import sqlalchemy as sa
+from sqlalchemy.event import listen as sa_listen
+
+
+__all__ = ("PoolStats",)
+
+logger = logging.getLogger("sqla_wrapper")
+
+
+class PoolStats:
+    """Collects usage statistics of the connection pool of an engine.
+
+    The numbers are gathered through the pool events (`connect`, `checkout`,
+    `checkin`, `invalidate`, etc.) so they survive an `engine.dispose()`.
+    The checkout wait time is the time spent getting a connection from the
+    pool, including opening a new one when needed.
+
+    Every `SQLAlchemy` instance has one of these as `db.pool_monitor`, so
+    you usually don't need to create it yourself:
+
+    ```python
+    db.pool_stats()
+    db.pool_monitor.start_logging(interval=60)
+    ```
+
+    Args:
+        engine: The engine to monitor.
+
+    """
+
+    def __init__(self, engine: sa.Engine) -> None:
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._stop_logging: "threading.Event | None" = None
+        self._logging_args: "t.Tuple[float, logging.Logger] | None" = None
+        # Functions called with the seconds of each checkout wait
+        self.wait_listeners: t.List[t.Callable[[float], None]] = []
+        self.reset()
+
+        sa_listen(engine, "connect", self._on_connect)
+        sa_listen(engine, "checkout", self._on_checkout)
+        sa_listen(engine, "checkin", self._on_checkin)
+        sa_listen(engine, "invalidate", self._on_invalidate)
+        sa_listen(engine, "soft_invalidate", self._on_soft_invalidate)
+        sa_listen(engine, "close", self._on_close)
+        sa_listen(engine, "detach", self._on_close)
+        sa_listen(engine, "engine_disposed", self._time_pool_connect)
+        self._time_pool_connect(engine)
+
+    def reset(self) -> None:
+        """Reset all the counters."""
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.checked_out = 0
+            self.peak_checked_out = 0
+            self.peak_overflow = 0
+            self.invalidations = 0
+            self.soft_invalidations = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self._connected_at: t.Dict[int, float] = {}
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """Return the current statistics as a dictionary."""
+        pool = self.engine.pool
+        now = monotonic()
+        with self._lock:
+            ages = [now - connected for connected in self._connected_at.values()]
+            waits = self.checkouts + self.timeouts
+            return {
+                "pool_size": _call(pool, "size"),
+                "checked_out": self.checked_out,
+                "idle": _call(pool, "checkedin"),
+                "overflow": _call(pool, "overflow"),
+                "peak_checked_out": self.peak_checked_out,
+                "peak_overflow": self.peak_overflow,
+                "connections": len(ages),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+                "wait_total": self.wait_total,
+                "wait_avg": self.wait_total / waits if waits else 0.0,
+                "wait_max": self.wait_max,
+                "oldest_connection_age": max(ages) if ages else 0.0,
+                "avg_connection_age": sum(ages) / len(ages) if ages else 0.0,
+            }
+
+    def start_logging(
+        self, interval: float = 60.0, *, log: logging.Logger = logger
+    ) -> None:
+        """Log the statistics every `interval` seconds from a daemon thread,
+        until `stop_logging()` is called.
+
+        Args:
+            interval: Seconds between each log entry.
+            log: Logger to use. The "sqla_wrapper" logger by default.
+
+        """
+        self.stop_logging()
+        stop = self._stop_logging = threading.Event()
+        self._logging_args = (interval, log)
+
+        def run() -> None:
+            while not stop.wait(interval):
+                log.info("Pool stats for %s: %s", self.engine.url, self.snapshot())
+
+        threading.Thread(
+            target=run, name="sqla_wrapper-pool-stats", daemon=True
+        ).start()
+
+    def stop_logging(self) -> None:
+        """Stop the periodic logging started by `start_logging()`."""
+        if self._stop_logging is not None:
+            self._stop_logging.set()
+            self._stop_logging = None
+        self._logging_args = None
+
+    def after_fork(self) -> None:
+        """Reset the statistics in a child process after a fork.
+
+        The inherited lock is replaced instead of acquired, because a thread
+        of the parent process could have been holding it, and the logging
+        thread, that doesn't survive the fork, is started again.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+        logging_args = self._logging_args
+        # Its thread is gone, and setting it could wait for that thread
+        self._stop_logging = None
+        self._logging_args = None
+        if logging_args is not None:
+            interval, log = logging_args
+            self.start_logging(interval, log=log)
+
+    # Private
+
+    def _time_pool_connect(self, engine: sa.Engine) -> None:
+        # There is no pool event fired *before* waiting for a connection,
+        # so the wait is measured around `connect()` of the pool itself,
+        # shared by the engine and all its `execution_options()` copies.
+        # `engine.dispose()` replaces the pool, so this is done again then.
+        pool = engine.pool
+        connect = pool.connect
+
+        @functools.wraps(connect)
+        def timed_connect() -> t.Any:
+            start = perf_counter()
+            try:
+                return connect()
+            except sa.exc.TimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise
+            finally:
+                self._record_wait(perf_counter() - start)
+
+        pool.connect = timed_connect  # type: ignore
+
+    def _record_wait(self, elapsed: float) -> None:
+        with self._lock:
+            self.wait_total += elapsed
+            if elapsed > self.wait_max:
+                self.wait_max = elapsed
+        for listener in self.wait_listeners:
+            listener(elapsed)
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+            self._connected_at[id(connection_record)] = monotonic()
+
+    def _on_checkout(self, dbapi_connection, connection_record, proxy) -> None:
+        overflow = _call(self.engine.pool, "overflow") or 0
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            if self.checked_out > self.peak_checked_out:
+                self.peak_checked_out = self.checked_out
+            if overflow > self.peak_overflow:
+                self.peak_overflow = overflow
+
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.invalidations += 1
+            self._connected_at.pop(id(connection_record), None)
+
+    def _on_soft_invalidate(
+        self, dbapi_connection, connection_record, exception
+    ) -> None:
+        with self._lock:
+            self.soft_invalidations += 1
+
+    def _on_close(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self._connected_at.pop(id(connection_record), None)
+
+
+def _call(pool: t.Any, name: str) -> "int | None":
+    """Not all the pool classes have the same methods, e.g.: `NullPool`
+    doesn't have `size()` or `overflow()`.
+    """
+    method = getattr(pool, name, None)
+    return method() if callable(method) else None
@@ -0,0 +1,207 @@
+import hashlib
+import typing as t
+from pathlib import Path
+
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import alembic
+
+from .json_file import read_json, write_json
+
+
+__all__ = ("ReflectionCache",)
+
+CACHE_FORMAT = 1
+
+_TableKey = t.Tuple["str | None", str]
+
+# One row for each table of the schema, with the definitions of its
+# columns, indexes and constraints, as the database sees them.
+POSTGRESQL_FINGERPRINTS = """
+SELECT c.relname, concat_ws(
+    '; ',
+    (SELECT string_agg(
+        a.attname || ' ' || format_type(a.atttypid, a.atttypmod)
+        || ' ' || a.attnotnull::text || ' ' || a.attidentity::text
+        || ' ' || coalesce(pg_get_expr(d.adbin, d.adrelid), '')
+        || ' ' || coalesce(col_description(c.oid, a.attnum), ''),
+        ', ' ORDER BY a.attnum)
+     FROM pg_attribute a
+     LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+     WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+    (SELECT string_agg(
+        pg_get_indexdef(i.indexrelid), ', ' ORDER BY pg_get_indexdef(i.indexrelid))
+     FROM pg_index i WHERE i.indrelid = c.oid),
+    (SELECT string_agg(
+        k.conname || ' ' || pg_get_constraintdef(k.oid), ', ' ORDER BY k.conname)
+     FROM pg_constraint k WHERE k.conrelid = c.oid),
+    obj_description(c.oid, 'pg_class')
+)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p')
+"""
+
+
+class ReflectionCache:
+    """Remembers which tables were found identical in the models and in
+    the database by the last autogenerate, with a fingerprint of both
+    definitions, so the next one can skip reflecting them if neither
+    has changed.
+
+    The fingerprint of a model is its `CREATE TABLE` and `CREATE INDEX`
+    statements. The fingerprint of a table in the database is read from
+    the catalog in a single query: the DDL stored by SQLite, or the
+    definitions of the columns, indexes and constraints in PostgreSQL.
+    With other databases, every table is reflected.
+
+    Use it through the `reflection_cache` argument of `Alembic`.
+
+    Args:
+        path: Path of the cache file.
+
+    """
+
+    def __init__(self, path: "str | Path") -> None:
+        self.path = Path(path)
+        self._fingerprints: t.Dict[_TableKey, t.Tuple[str, str]] = {}
+        self._skip: t.Set[_TableKey] = set()
+        self._compared: t.Set[_TableKey] = set()
+        self._cached: t.Dict[_TableKey, t.Tuple[str, str]] = {}
+        self._settings: t.Dict[str, t.Any] = {}
+
+    def start(self, connection: sa.Connection, metadata: sa.MetaData) -> None:
+        """Read the fingerprints of the tables and find the ones that
+        can be skipped. Called before running the autogenerate.
+        """
+        dialect = connection.dialect
+        self._settings = {"dialect": dialect.name, "alembic": alembic.__version__}
+        self._fingerprints = {}
+        schemas = {table.schema for table in metadata.tables.values()}
+        for schema in schemas:
+            in_database = _get_database_fingerprints(connection, schema)
+            for table in metadata.tables.values():
+                if table.schema != schema or table.name not in in_database:
+                    continue
+                in_model = _get_model_fingerprint(table, dialect)
+                if in_model is not None:
+                    key = (schema, table.name)
+                    self._fingerprints[key] = (in_database[table.name], in_model)
+
+        self._compared = set()
+        self._cached = self._load()
+        self._skip = {
+            key
+            for key, fingerprints in self._fingerprints.items()
+            if self._cached.get(key) == fingerprints
+        }
+
+    def is_needed(self, name: str, schema: "str | None" = None) -> bool:
+        """Return `False` if the table hasn't changed since the last time
+        it was found identical in the models and in the database.
+        """
+        return (schema, name) not in self._skip
+
+    def mark_compared(self, name: str, schema: "str | None" = None) -> None:
+        """Record that the table is included in this autogenerate, so its
+        result can be saved. The tables left out by the filters are not
+        compared, so their previous entries are kept as they were.
+        """
+        self._compared.add((schema, name))
+
+    def save(self, upgrade_ops: t.Any) -> None:
+        """Remember the compared tables without changes in the operations
+        generated by the autogenerate.
+        """
+        changed = {
+            (getattr(op, "schema", None), op.table_name)
+            for op in upgrade_ops.ops
+            if getattr(op, "table_name", None)
+        }
+        entries = {
+            key: fingerprints
+            for key, fingerprints in self._cached.items()
+            if key not in self._compared
+        }
+        for key, fingerprints in self._fingerprints.items():
+            if key in self._compared and key not in changed:
+                entries[key] = fingerprints
+        tables = [
+            [schema, name, *fingerprints]
+            for (schema, name), fingerprints in entries.items()
+        ]
+        data = {"format": CACHE_FORMAT, "settings": self._settings, "tables": tables}
+        try:
+            write_json(self.path, data)
+        except OSError:
+            # A read-only filesystem only means no caching
+            pass
+
+    def clear(self) -> None:
+        """Delete the cache file."""
+        self._skip = set()
+        if self.path.exists():
+            self.path.unlink()
+
+    # Private
+
+    def _load(self) -> t.Dict[_TableKey, t.Tuple[str, str]]:
+        data = read_json(self.path)
+        if not isinstance(data, dict):
+            return {}
+        if data.get("format") != CACHE_FORMAT or data.get("settings") != self._settings:
+            return {}
+        return {
+            (schema, name): (in_database, in_model)
+            for schema, name, in_database, in_model in data.get("tables", [])
+        }
+
+
+def _get_database_fingerprints(
+    connection: sa.Connection, schema: "str | None"
+) -> t.Dict[str, str]:
+    dialect = connection.dialect
+    if dialect.name == "sqlite":
+        master = "sqlite_master"
+        if schema:
+            master = f"{dialect.identifier_preparer.quote(schema)}.sqlite_master"
+        rows = connection.execute(
+            sa.text(
+                f"SELECT tbl_name, sql FROM {master} WHERE sql IS NOT NULL "
+                "ORDER BY tbl_name, type, name"
+            )
+        )
+        ddl: t.Dict[str, t.List[str]] = {}
+        for name, sql in rows:
+            ddl.setdefault(name, []).append(sql)
+        return {name: _hash("; ".join(sqls)) for name, sqls in ddl.items()}
+
+    if dialect.name == "postgresql":
+        rows = connection.execute(
+            sa.text(POSTGRESQL_FINGERPRINTS),
+            {"schema": schema or dialect.default_schema_name},
+        )
+        return {name: _hash(definition or "") for name, definition in rows}
+
+    return {}
+
+
+def _get_model_fingerprint(table: sa.Table, dialect: sa.Dialect) -> "str | None":
+    try:
+        parts = [str(CreateTable(table).compile(dialect=dialect))]
+        parts.extend(
+            sorted(
+                str(CreateIndex(index).compile(dialect=dialect))
+                for index in table.indexes
+            )
+        )
+    except sa.exc.SQLAlchemyError:
+        return None
+    parts.append(repr(table.comment))
+    parts.extend(repr(column.comment) for column in table.columns)
+    return _hash("; ".join(parts))
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
@@ -0,0 +1,168 @@
+import ast
+import copy
+import typing as t
+from pathlib import Path
+from types import ModuleType
+
+from alembic.script import Script, ScriptDirectory
+from alembic.script.revision import RevisionMap
+
+from .json_file import read_json, write_json
+
+
+__all__ = ("RevisionCache",)
+
+CACHE_FORMAT = 1
+# The module-level variables of a revision file that define the graph
+REVISION_VARS = ("revision", "down_revision", "branch_labels", "depends_on")
+
+
+class RevisionCache:
+    """Keeps the revision graph of a migrations folder (ids, parents,
+    branch labels, dependencies and docstrings) in a JSON file, so
+    reading it doesn't require importing every revision file.
+
+    A file is parsed again only if its modification time or size changed.
+    The revision files are read with `ast`, and imported only if their
+    variables aren't plain literals.
+
+    Use it through the `revision_cache` argument of `Alembic`.
+
+    Args:
+        script_directory: The alembic `ScriptDirectory` of the migrations.
+        path: Path of the cache file.
+
+    """
+
+    def __init__(self, script_directory: ScriptDirectory, path: "str | Path") -> None:
+        self.script_directory = script_directory
+        self.path = Path(path)
+        self._entries: "t.Dict[str, t.Dict[str, t.Any]] | None" = None
+        self._stamp: t.Dict[str, t.Tuple[int, int]] = {}
+        self._cached: "ScriptDirectory | None" = None
+
+    def get_script_directory(self) -> ScriptDirectory:
+        """Return a copy of the script directory whose revision map is
+        built from the cache.
+
+        The `Script` objects of that copy don't have the real module of the
+        revision, so they can be used to read the revision graph but not to
+        run the migrations.
+        """
+        stamp = self._scan()
+        if self._cached is not None and stamp == self._stamp:
+            return self._cached
+
+        entries = self._load()
+        scripts = []
+        changed = set(entries) != set(stamp)
+        new_entries = {}
+        for filename, (mtime, size) in stamp.items():
+            entry = entries.get(filename)
+            if entry is None or entry["mtime"] != mtime or entry["size"] != size:
+                entry = {"mtime": mtime, "size": size, "meta": self._parse(filename)}
+                changed = True
+            new_entries[filename] = entry
+            if entry["meta"] is not None:
+                scripts.append(_make_script(entry["meta"], filename))
+
+        self._entries = new_entries
+        if changed:
+            self._save(new_entries)
+
+        directory = copy.copy(self.script_directory)
+        directory.revision_map = RevisionMap(lambda: iter(scripts))
+        self._stamp = stamp
+        self._cached = directory
+        return directory
+
+    def clear(self) -> None:
+        """Delete the cache file."""
+        self._entries = None
+        self._cached = None
+        self._stamp = {}
+        if self.path.exists():
+            self.path.unlink()
+
+    # Private
+
+    def _scan(self) -> t.Dict[str, t.Tuple[int, int]]:
+        sd = self.script_directory
+        stamp = {}
+        for location in sd._version_locations:
+            if not location.exists():
+                continue
+            for file_path in Script._list_py_dir(sd, location):
+                if file_path.suffix != ".py" or file_path.name.startswith(
+                    (".#", "__init__")
+                ):
+                    continue
+                stat = file_path.stat()
+                stamp[str(file_path.resolve())] = (stat.st_mtime_ns, stat.st_size)
+        return stamp
+
+    def _load(self) -> t.Dict[str, t.Dict[str, t.Any]]:
+        if self._entries is not None:
+            return self._entries
+        data = read_json(self.path)
+        if not isinstance(data, dict):
+            return {}
+        if data.get("format") != CACHE_FORMAT:
+            return {}
+        return data.get("files", {})
+
+    def _save(self, entries: t.Dict[str, t.Dict[str, t.Any]]) -> None:
+        data = {"format": CACHE_FORMAT, "files": entries}
+        try:
+            write_json(self.path, data)
+        except OSError:
+            # A read-only filesystem only means no caching
+            pass
+
+    def _parse(self, filename: str) -> "t.Dict[str, t.Any] | None":
+        meta = _parse_revision_file(Path(filename))
+        if meta is not None:
+            return meta
+        # Not plain literals, so the file has to be imported
+        script = Script._from_path(self.script_directory, filename)
+        if script is None:
+            return None
+        module = script.module
+        meta = {name: getattr(module, name, None) for name in REVISION_VARS}
+        meta["revision"] = script.revision
+        meta["doc"] = module.__doc__
+        return meta
+
+
+def _parse_revision_file(path: Path) -> "t.Dict[str, t.Any] | None":
+    try:
+        tree = ast.parse(path.read_bytes(), filename=str(path))
+    except SyntaxError:
+        return None
+    meta: t.Dict[str, t.Any] = {"doc": ast.get_docstring(tree, clean=False)}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        if not isinstance(target, ast.Name) or target.id not in REVISION_VARS:
+            continue
+        try:
+            meta[target.id] = ast.literal_eval(value)
+        except ValueError:
+            return None
+    if not isinstance(meta.get("revision"), str):
+        return None
+    return meta
+
+
+def _make_script(meta: t.Dict[str, t.Any], filename: str) -> Script:
+    # A stand-in for the module of the revision, with just the variables
+    # that `Script` reads.
+    module = ModuleType(Path(filename).stem, meta["doc"])
+    for name in REVISION_VARS:
+        value = meta.get(name)
+        setattr(module, name, tuple(value) if isinstance(value, list) else value)
+    return Script(module, meta["revision"], filename)
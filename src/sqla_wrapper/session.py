@@ -1,12 +1,20 @@
 import typing as t
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
 
 import sqlalchemy.orm
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext import horizontal_shard
 from sqlalchemy.orm import scoped_session
+from sqlalchemy.util import ScopedRegistry
 
+from .base_model import get_record_class
+from .batch_loader import BatchLoader, Load
 
-__all__ = ("Session",)
+
+__all__ = ("Session", "ShardedSession")
 
 
 class Session(sqlalchemy.orm.Session):
@@ -15,9 +23,101 @@ class Session(sqlalchemy.orm.Session):
 
     This class extends the `sqlalchemy.orm.Session` class with some useful
     active-record-like methods.
+
+    It also accepts a `statement_timeout` and a `lock_timeout`, in seconds,
+    that are applied to every transaction of the session. See `timeout()`.
+
+    The `named_binds` argument is a dictionary of engines used instead of the
+    default one for the models with a matching `__bind_key__` attribute.
     """
 
-    def all(self, Model: t.Any, **attrs) -> t.Sequence[t.Any]:
+    def __init__(
+        self,
+        *args: t.Any,
+        statement_timeout: "float | None" = None,
+        lock_timeout: "float | None" = None,
+        named_binds: "t.Dict[t.Any, t.Any] | None" = None,
+        **kwargs: t.Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.named_binds = named_binds or {}
+        self._batch_depth = 0
+        self._loader: "BatchLoader | None" = None
+        self.statement_timeout = None
+        self.lock_timeout = None
+        self._timeouts_listener = False
+        if statement_timeout is not None or lock_timeout is not None:
+            self.set_timeouts(statement_timeout, lock_timeout)
+
+    def get_bind(
+        self, mapper: t.Any = None, clause: t.Any = None, **kw: t.Any
+    ) -> t.Any:
+        if mapper is not None:
+            cls = getattr(mapper, "class_", mapper)
+            bind_key = getattr(cls, "__bind_key__", None)
+            if bind_key is not None:
+                if bind_key not in self.named_binds:
+                    raise ValueError(
+                        f"{cls.__name__!r} uses the bind {bind_key!r}, "
+                        "but there is no bind with that name"
+                    )
+                return self.named_binds[bind_key]
+        return super().get_bind(mapper, clause=clause, **kw)
+
+    def set_timeouts(
+        self,
+        statement_timeout: "float | None" = None,
+        lock_timeout: "float | None" = None,
+    ) -> None:
+        """Set the maximum time, in seconds, that a statement can run and that
+        it can wait for a lock, for this and the following transactions of
+        the session. Use `None` to restore the default of the database.
+
+        On PostgreSQL these are `SET LOCAL statement_timeout` and
+        `SET LOCAL lock_timeout`. On MySQL, `max_execution_time` (that only
+        applies to `SELECT` statements) and `innodb_lock_wait_timeout`,
+        restored when the connection returns to the pool. On SQLite, the
+        statements are interrupted by a progress handler and the lock timeout
+        is the `busy_timeout`.
+        """
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        if not self._timeouts_listener:
+            event.listen(self, "after_begin", _after_begin)
+            self._timeouts_listener = True
+        if self.in_transaction():
+            _apply_timeouts(self.connection(), statement_timeout, lock_timeout)
+
+    @contextmanager
+    def timeout(
+        self,
+        statement: "float | None" = None,
+        lock: "float | None" = None,
+    ) -> t.Iterator["Session"]:
+        """Use these statement and lock timeouts, in seconds, until the end
+        of the block. See `set_timeouts()`.
+
+        **Example**:
+
+        ```python
+        with db.s.timeout(statement=2.0, lock=0.5):
+            db.s.execute(expensive_report)
+        ```
+        """
+        previous = (self.statement_timeout, self.lock_timeout)
+        self.set_timeouts(statement, lock)
+        try:
+            yield self
+        finally:
+            self.set_timeouts(*previous)
+
+    def all(
+        self,
+        Model: t.Any,
+        *,
+        as_record: "bool | t.Sequence[str]" = False,
+        **attrs: t.Any,
+    ) -> t.Sequence[t.Any]:
         """Returns all the object found with these attributes.
 
         The filtering is done with a simple `.filter_by()` so is limited
@@ -25,14 +125,25 @@ class Session(sqlalchemy.orm.Session):
         Also, there is no way to sort the results. If you need sorting or
         more complex filtering, you are better served using a `db.select()`.
 
+        With `as_record=True`, it returns read-only named tuples with the
+        values of the columns, instead of model objects. These are much
+        lighter and faster to build, but they are not tracked by the session
+        so changing them does nothing. `as_record` can also be a list of
+        column names, to get only those.
+
         **Examples**:
 
         ```python
         users = db.s.all(User)
         users = db.s.all(User, deleted=False)
         users = db.s.all(User, account_id=123, deleted=False)
+        emails = db.s.all(User, as_record=["id", "email"])
         ```
         """
+        if as_record:
+            Record, stmt = self._select_records(Model, as_record)
+            result = self.execute(stmt.filter_by(**attrs))
+            return list(map(Record._make, result))
         return self.execute(select(Model).filter_by(**attrs)).scalars().all()
 
     def create(self, Model: t.Any, **attrs: t.Any) -> t.Any:
@@ -49,6 +160,9 @@ class Session(sqlalchemy.orm.Session):
         Note that this does a `db.s.flush()`, so you must later call
         `db.s.commit()` to persist the new object.
 
+        Inside a `db.s.batch()` block, the flush is delayed until the end
+        of the block.
+
         **Example**:
 
         ```python
@@ -58,10 +172,54 @@ class Session(sqlalchemy.orm.Session):
         """
         obj = Model(**attrs)
         self.add(obj)
-        self.flush()
+        if not self._batch_depth:
+            self.flush()
         return obj
 
-    def first(self, Model: t.Any, **attrs: t.Any) -> t.Any:
+    def _select_records(
+        self, Model: t.Any, as_record: "bool | t.Sequence[str]"
+    ) -> t.Tuple[t.Any, t.Any]:
+        names = None if as_record is True else as_record
+        Record = get_record_class(Model, names)
+        return Record, select(*[getattr(Model, name) for name in Record._columns])
+
+    @contextmanager
+    def batch(self) -> t.Iterator["Session"]:
+        """Delay the flush of the objects created with `create()` until
+        the end of the block, so they are inserted together instead of one
+        round trip per object: with a single `executemany()` if their
+        primary keys are already set, or else with batched
+        `INSERT ... RETURNING` statements where the database can return
+        the generated keys in order (e.g. PostgreSQL, but not SQLite, where
+        they are still inserted one by one).
+
+        Any query run inside the block triggers the flush first (if
+        `autoflush` has not been disabled), so it sees the new objects.
+
+        **Example**:
+
+        ```python
+        with db.s.batch():
+            for name in names:
+                db.s.create(Tag, name=name)
+        db.s.commit()
+        ```
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+        if not self._batch_depth:
+            self.flush()
+
+    def first(
+        self,
+        Model: t.Any,
+        *,
+        as_record: "bool | t.Sequence[str]" = False,
+        **attrs: t.Any,
+    ) -> t.Any:
         """Returns the first object found with these attributes or `None`
         if there isn't one.
 
@@ -70,6 +228,8 @@ class Session(sqlalchemy.orm.Session):
         Also, there is no way to sort the results. If you need sorting or
         more complex filtering, you are better served using a `db.select()`.
 
+        See `all()` for the `as_record` argument.
+
         **Examples**:
 
         ```python
@@ -77,6 +237,10 @@ class Session(sqlalchemy.orm.Session):
         user = db.s.first(User, deleted=False)
         ```
         """
+        if as_record:
+            Record, stmt = self._select_records(Model, as_record)
+            row = self.execute(stmt.filter_by(**attrs).limit(1)).first()
+            return None if row is None else Record._make(row)
         return self.execute(
             select(Model).filter_by(**attrs).limit(1)
         ).scalars().first()
@@ -114,6 +278,10 @@ class Session(sqlalchemy.orm.Session):
         This does a `db.s.flush()`, so you must later call `db.s.commit()`
         to persist the new object (in case one has been created).
 
+        If the object already exists, the whole transaction is rolled back.
+        Inside a `db.s.batch()` block, the queued objects are flushed first
+        and only a savepoint is rolled back instead.
+
         **Examples**:
 
         ```python
@@ -122,14 +290,336 @@ class Session(sqlalchemy.orm.Session):
         user1 is user2
         ```
         """
+        if self._batch_depth:
+            return self._create_or_first_nested(Model, **attrs)
         try:
             return self.create(Model, **attrs)
         except IntegrityError:
             self.rollback()
         return self.first(Model, **attrs)
 
+    def _create_or_first_nested(self, Model: t.Any, **attrs: t.Any) -> t.Any:
+        # Inside a batch, insert the queued objects first and only roll back
+        # to a savepoint, so a duplicate doesn't discard them.
+        self.flush()
+        try:
+            with self.begin_nested():
+                obj = Model(**attrs)
+                self.add(obj)
+            return obj
+        except IntegrityError:
+            pass
+        return self.first(Model, **attrs)
+
+    @property
+    def loader(self) -> BatchLoader:
+        """The `BatchLoader` of this session."""
+        if self._loader is None:
+            self._loader = BatchLoader(self)
+            event.listen(self, "after_rollback", _clear_loader)
+        return self._loader
+
+    def load(
+        self,
+        Model: t.Any,
+        key: t.Any,
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> Load:
+        """Ask for an object by its primary key, or by another `column`,
+        to be fetched together with the other pending lookups of the same
+        model and column, in a single query. With `many=True`, ask for the
+        list of all the objects with that value instead.
+
+        Returns a `Load` object. Call its `result()` method, or `await` it,
+        to get the object (or `None` if it doesn't exist).
+
+        The results are remembered until the session is closed or rolled
+        back.
+
+        **Example**:
+
+        ```python
+        authors = [db.s.load(User, post.author_id) for post in posts]
+        [author.result() for author in authors]  # Only one query
+        ```
+        """
+        return self.loader.load(Model, key, column=column, many=many)
+
+    def load_all(
+        self,
+        Model: t.Any,
+        keys: t.Iterable[t.Any],
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> t.List[Load]:
+        """Like `load()` for each one of the keys."""
+        return self.loader.load_all(Model, keys, column=column, many=many)
+
+    def dispatch_loads(self) -> None:
+        """Run the queries of all the pending `load()` lookups.
+
+        (`dispatch` is the name of the session events attribute.)
+        """
+        if self._loader is not None:
+            self._loader.dispatch()
+
+    def close(self) -> None:
+        if self._loader is not None:
+            self._loader.clear()
+        super().close()
+
+
+class ShardedSession(horizontal_shard.ShardedSession, Session):
+    """A `Session` that distributes the models across several databases
+    ("shards"), using SQLAlchemy's horizontal sharding extension.
+
+    The queries without a specific shard are run on every shard returned by
+    the `execute_chooser` function. If a `shard_executor` is given, these
+    queries are run in parallel on it, and their results merged.
+    """
+
+    def __init__(
+        self, *args: t.Any, shard_executor: t.Any = None, **kwargs: t.Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.shard_executor = shard_executor
+        if shard_executor is not None:
+            # Must run before the listener of the extension
+            event.listen(
+                self, "do_orm_execute", _execute_in_parallel, retval=True, insert=True
+            )
+
+
+def _execute_in_parallel(orm_context: t.Any) -> t.Any:
+    session = orm_context.session
+    if (
+        not orm_context.is_select
+        or "shard_id" in orm_context.bind_arguments
+        or "_sa_shard_id" in orm_context.execution_options
+        or orm_context.load_options._identity_token is not None
+        or any(
+            isinstance(opt, horizontal_shard.set_shard_id)
+            for opt in orm_context._non_compile_orm_options
+        )
+    ):
+        # Let the extension deal with it
+        return None
+
+    shard_ids = list(session.execute_chooser(orm_context))
+    if len(shard_ids) < 2:
+        return None
+
+    # The pending changes are flushed and the connections are acquired
+    # here, because the session isn't thread-safe. The threads only execute
+    # the statement; the ORM objects are created when the merged result is
+    # consumed, in this thread.
+    if orm_context.load_options._autoflush:
+        session._autoflush()
+    bind_arguments = [
+        {**orm_context.bind_arguments, "shard_id": shard_id} for shard_id in shard_ids
+    ]
+    for bind_args in bind_arguments:
+        session.connection(bind_arguments=bind_args)
+
+    futures = [
+        session.shard_executor.submit(
+            orm_context.invoke_statement,
+            bind_arguments=bind_args,
+            execution_options={
+                "identity_token": bind_args["shard_id"],
+                "autoflush": False,
+            },
+        )
+        for bind_args in bind_arguments
+    ]
+    results = [future.result() for future in futures]
+    return results[0].merge(*results[1:])
+
+
+def _clear_loader(session: Session) -> None:
+    # The remembered objects might not exist anymore
+    if session._loader is not None:
+        session._loader.clear()
+
+
+def _after_begin(session: Session, transaction: t.Any, connection: t.Any) -> None:
+    if session.statement_timeout is None and session.lock_timeout is None:
+        return
+    _apply_timeouts(connection, session.statement_timeout, session.lock_timeout)
+
+
+def _apply_timeouts(
+    connection: t.Any,
+    statement_timeout: "float | None",
+    lock_timeout: "float | None",
+) -> None:
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        for name, value in (
+            ("statement_timeout", statement_timeout),
+            ("lock_timeout", lock_timeout),
+        ):
+            value = "DEFAULT" if value is None else int(value * 1000)
+            connection.exec_driver_sql(f"SET LOCAL {name} = {value}")
+
+    elif dialect in ("mysql", "mariadb"):
+        # These are session variables, so they are restored at checkin
+        _listen_once(connection.engine, "checkin", _reset_mysql_timeouts)
+        connection.info["sqla_wrapper_timeouts"] = True
+        statement = (
+            "DEFAULT" if statement_timeout is None else int(statement_timeout * 1000)
+        )
+        lock = "DEFAULT" if lock_timeout is None else max(int(lock_timeout), 1)
+        connection.exec_driver_sql(
+            f"SET SESSION max_execution_time = {statement}, "
+            f"innodb_lock_wait_timeout = {lock}"
+        )
+
+    elif dialect == "sqlite":
+        _listen_once(connection.engine, "checkin", _reset_sqlite_timeouts)
+        _listen_once(
+            connection.engine, "before_cursor_execute", _start_sqlite_statement
+        )
+        info = connection.info
+        dbapi_connection = connection.connection.dbapi_connection
+        if "sqla_wrapper_busy_timeout" not in info:
+            info["sqla_wrapper_busy_timeout"] = dbapi_connection.execute(
+                "PRAGMA busy_timeout"
+            ).fetchone()[0]
+        busy_timeout = (
+            info["sqla_wrapper_busy_timeout"]
+            if lock_timeout is None
+            else int(lock_timeout * 1000)
+        )
+        dbapi_connection.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+        if statement_timeout is None:
+            info.pop("sqla_wrapper_statement_timeout", None)
+            dbapi_connection.set_progress_handler(None, 0)
+        else:
+            deadline = info["sqla_wrapper_statement_timeout"] = [
+                statement_timeout,
+                monotonic() + statement_timeout,
+            ]
+            dbapi_connection.set_progress_handler(
+                lambda: monotonic() > deadline[1], 1000
+            )
+
+
+def _listen_once(target: t.Any, identifier: str, fn: t.Callable) -> None:
+    if not event.contains(target, identifier, fn):
+        event.listen(target, identifier, fn)
+
+
+def _reset_mysql_timeouts(dbapi_connection: t.Any, connection_record: t.Any) -> None:
+    if dbapi_connection is None:
+        return
+    if connection_record.info.pop("sqla_wrapper_timeouts", None):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(
+            "SET SESSION max_execution_time = DEFAULT, "
+            "innodb_lock_wait_timeout = DEFAULT"
+        )
+        cursor.close()
+
+
+def _reset_sqlite_timeouts(dbapi_connection: t.Any, connection_record: t.Any) -> None:
+    if dbapi_connection is None:
+        return
+    info = connection_record.info
+    if info.pop("sqla_wrapper_statement_timeout", None):
+        dbapi_connection.set_progress_handler(None, 0)
+    busy_timeout = info.pop("sqla_wrapper_busy_timeout", None)
+    if busy_timeout is not None:
+        dbapi_connection.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+
+def _start_sqlite_statement(conn, cursor, statement, parameters, context, executemany):
+    deadline = conn.info.get("sqla_wrapper_statement_timeout")
+    if deadline:
+        deadline[1] = monotonic() + deadline[0]
+
+
+class ContextVarRegistry(ScopedRegistry):
+    """A registry that stores the session in a context variable instead
+    of a thread-local.
+
+    Every asyncio task runs in a copy of the context of the code that created
+    it, so tasks started before there is a session get their own one, even in
+    the same thread. But if the session already exists when a task is created
+    (e.g.: inside a request handled by `ASGIMiddleware`), the task shares it.
+    A session must not be used concurrently, so run such tasks inside
+    `with db.s.scope(): ...` to give them a new session.
+
+    Plain threads each start with their own context, so outside asyncio
+    this behaves like the default thread-local registry.
+    """
+
+    def __init__(self, createfunc: t.Callable[[], t.Any]) -> None:
+        self.createfunc = createfunc
+        self.var: "ContextVar[t.Any]" = ContextVar(
+            f"sqla_wrapper_session_{id(self)}", default=None
+        )
+
+    def __call__(self) -> t.Any:
+        obj = self.var.get()
+        if obj is None:
+            obj = self.createfunc()
+            self.var.set(obj)
+        return obj
+
+    def has(self) -> bool:
+        return self.var.get() is not None
+
+    def set(self, obj: t.Any) -> None:
+        self.var.set(obj)
+
+    def clear(self) -> None:
+        self.var.set(None)
+
 
 class PatchedScopedSession(scoped_session):
+    def __init__(
+        self,
+        session_factory: t.Any,
+        scopefunc: "t.Callable[[], t.Any] | None" = None,
+        *,
+        use_contextvars: bool = False,
+    ) -> None:
+        super().__init__(session_factory, scopefunc=scopefunc)
+        if use_contextvars:
+            self.registry = ContextVarRegistry(session_factory)
+
+    @contextmanager
+    def scope(self, **kwargs: t.Any) -> t.Iterator[t.Any]:
+        """Use a new session as the scoped session until the end of the block.
+        At the end, the session is closed and removed, and the previous one,
+        if any, is restored.
+
+        Any argument is passed to the session factory.
+
+        **Example**:
+
+        ```python
+        with db.s.scope():
+            user = db.s.first(User, id=user_id)
+            ...
+            db.s.commit()
+        ```
+        """
+        previous = self.registry() if self.registry.has() else None
+        session = self.session_factory(**kwargs)
+        self.registry.set(session)
+        try:
+            yield session
+        finally:
+            self.remove()
+            if previous is not None:
+                self.registry.set(previous)
+
     def all(self, Model: t.Any, **attrs) -> t.List[t.Any]:
         return self.registry().all(Model, **attrs)
 
@@ -144,3 +634,41 @@ class PatchedScopedSession(scoped_session):
 
     def create_or_first(self, Model: t.Any, **attrs) -> t.Any:
         return self.registry().create_or_first(Model, **attrs)
+
+    def batch(self) -> t.ContextManager[Session]:
+        return self.registry().batch()
+
+    def load(
+        self,
+        Model: t.Any,
+        key: t.Any,
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> Load:
+        return self.registry().load(Model, key, column=column, many=many)
+
+    def load_all(
+        self,
+        Model: t.Any,
+        keys: t.Iterable[t.Any],
+        *,
+        column: "str | None" = None,
+        many: bool = False,
+    ) -> t.List[Load]:
+        return self.registry().load_all(Model, keys, column=column, many=many)
+
+    def dispatch_loads(self) -> None:
+        return self.registry().dispatch_loads()
+
+    def set_timeouts(
+        self,
+        statement_timeout: "float | None" = None,
+        lock_timeout: "float | None" = None,
+    ) -> None:
+        return self.registry().set_timeouts(statement_timeout, lock_timeout)
+
+    def timeout(
+        self, statement: "float | None" = None, lock: "float | None" = None
+    ) -> t.ContextManager[Session]:
+        return self.registry().timeout(statement, lock)
@@ -1,11 +1,19 @@
+import os
 import typing as t
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
 
 import sqlalchemy as sa
 from sqlalchemy import orm as sa_orm
 from sqlalchemy.event import listens_for as sa_listens_for
 
 from .base_model import BaseModel
-from .session import PatchedScopedSession, Session
+from .pool_stats import PoolStats
+from .session import PatchedScopedSession, Session, ShardedSession
+from .transaction import Transaction
 
 
 __all__ = ("SQLAlchemy", "TestTransaction")
@@ -46,6 +54,58 @@ class SQLAlchemy:
         deleted: Mapped[datetime] = mapped_column(sa.DateTime)
     ```
 
+    By default, the engine is disposed and the scoped session reset in the child
+    processes after a `fork()`, so the connections of the parent process are
+    never shared. That makes it safe to load the application before forking
+    the workers in servers like gunicorn. Use `fork_safe=False` to disable it,
+    and `warmup_after_fork=True` to also call `db.warmup()` in each child.
+
+    The scoped session `db.s` is thread-local by default. With
+    `session_scope="context"` it is stored in a context variable instead,
+    so concurrent asyncio tasks get their own session, unless they are
+    created after their parent task used one (see `ContextVarRegistry`).
+    In both cases,
+    `with db.s.scope(): ...` uses a new session for the duration of the block
+    and removes it at the end.
+
+    Models can be stored in other databases by giving a name and URL to each of
+    them with `binds`, and adding a `__bind_key__` attribute with that name to
+    the models. Each bind has its own engine, stored in `db.engines`, and
+    the session uses the right one for each model. A `__bind_key__` that is
+    not one of the `binds` raises a `ValueError`.
+
+    ```python
+    db = SQLAlchemy(database_uri, binds={"analytics": analytics_uri})
+
+    class PageView(db.Model):
+        __tablename__ = "page_views"
+        __bind_key__ = "analytics"
+        ...
+    ```
+
+    Tables not mapped to a model can use `info={"bind_key": "analytics"}` instead.
+
+    For schema-per-tenant databases, declare the tenant models without a schema
+    and use `with db.tenant(schema): ...`. See `tenant()`.
+
+    To split the data across several databases with the same schema, give
+    a dictionary of URLs as `shards` instead of a single URL, and a
+    `shard_chooser(mapper, instance, clause=None)` function that returns
+    the name of the shard where a new object is stored. The `identity_chooser`
+    and `execute_chooser` functions select the shards to search for a primary
+    key or to run a query; by default, all of them. The queries that run on
+    several shards do it in parallel, in a pool of threads. The engine of each
+    shard is in `db.shards`, and `db.pool_stats(shard_id)` returns the
+    statistics of its pool.
+    See [Horizontal Sharding](https://docs.sqlalchemy.org/en/20/orm/extensions/horizontal_shard.html).
+
+    ```python
+    db = SQLAlchemy(
+        shards={"eu": eu_uri, "us": us_uri},
+        shard_chooser=lambda mapper, instance, clause=None: instance.region,
+    )
+    ```
+
     """
 
     def __init__(
@@ -59,10 +119,20 @@ class SQLAlchemy:
         host: "str | None" = None,
         port: "str | int | None" = None,
         engine_options: "t.Dict[str, t.Any] | None" = None,
+        binds: "t.Dict[str, str] | None" = None,
+        shards: "t.Dict[str, str] | None" = None,
+        shard_chooser: "t.Callable | None" = None,
+        identity_chooser: "t.Callable | None" = None,
+        execute_chooser: "t.Callable | None" = None,
         session_options: "t.Dict[str, t.Any] | None" = None,
+        session_scope: str = "thread",
         base_model_class: t.Any = BaseModel,
         base_model_metaclass: t.Any = sa_orm.DeclarativeMeta,
+        fork_safe: bool = True,
+        warmup_after_fork: bool = False,
     ) -> None:
+        if shards and not url:
+            url = next(iter(shards.values()))
         self.url = url or self._make_url(
             dialect=dialect,
             host=host,
@@ -74,6 +144,29 @@ class SQLAlchemy:
         engine_options = engine_options or {}
         engine_options.setdefault("future", True)
         self.engine = sa.create_engine(self.url, **engine_options)
+        self.shards: t.Dict[str, sa.Engine] = {}
+        self.shard_executor: "ThreadPoolExecutor | None" = None
+        if shards:
+            self.shards = {
+                shard_id: self.engine
+                if shard_url == self.url
+                else sa.create_engine(shard_url, **engine_options)
+                for shard_id, shard_url in shards.items()
+            }
+            self.shard_executor = self._make_shard_executor()
+        self.engines: "t.Dict[str | None, sa.Engine]" = {None: self.engine}
+        for key, bind_url in (binds or {}).items():
+            self.engines[key] = sa.create_engine(bind_url, **engine_options)
+        self.pool_monitors = {
+            key: PoolStats(engine) for key, engine in self.engines.items()
+        }
+        for shard_id, engine in self.shards.items():
+            if engine is self.engine:
+                continue
+            if shard_id in self.pool_monitors:
+                raise ValueError(f"The shard {shard_id!r} has the name of a bind")
+            self.pool_monitors[shard_id] = PoolStats(engine)
+        self.pool_monitor = self.pool_monitors[None]
 
         self.registry = sa_orm.registry()
         self.Model = self.registry.generate_base(
@@ -83,21 +176,57 @@ class SQLAlchemy:
         )
 
         session_options = session_options or {}
+        if shards:
+            if shard_chooser is None:
+                raise ValueError("`shard_chooser` is required when using shards")
+            session_options.setdefault("class_", ShardedSession)
+            session_options.setdefault("shards", self.shards)
+            session_options.setdefault("shard_chooser", shard_chooser)
+            session_options.setdefault(
+                "identity_chooser", identity_chooser or self._all_shards
+            )
+            session_options.setdefault(
+                "execute_chooser", execute_chooser or self._all_shards
+            )
+            session_options.setdefault("shard_executor", self.shard_executor)
         session_options.setdefault("class_", Session)
         session_options.setdefault("bind", self.engine)
         session_options.setdefault("future", True)
+        if binds:
+            session_options.setdefault("named_binds", self.engines)
         self.session_class = session_options["class_"]
         self.Session = sa_orm.sessionmaker(**session_options)
-        self.s = PatchedScopedSession(self.Session)
+        if session_scope not in ("thread", "context"):
+            raise ValueError("session_scope must be either 'thread' or 'context'")
+        self.s = PatchedScopedSession(
+            self.Session, use_contextvars=session_scope == "context"
+        )
+
+        # Extra statements to be pre-compiled by `warmup()`
+        self.warmup_statements: t.List[t.Any] = []
+
+        self._tenant_engines: t.Dict[str, sa.Engine] = {}
+        self._current_tenant: "ContextVar[str | None]" = ContextVar(
+            f"sqla_wrapper_tenant_{id(self)}", default=None
+        )
+
+        # Counters updated by `db.transaction()`
+        self.transaction_stats: t.Dict[str, int] = {}
+
+        self.warmup_after_fork = warmup_after_fork
+        if fork_safe and hasattr(os, "register_at_fork"):
+            # A weak reference, because these handlers can't be unregistered
+            os.register_at_fork(after_in_child=_get_after_fork(weakref.ref(self)))
 
     def create_all(self, **kwargs) -> None:
-        """Creates all the tables of the models registered so far.
+        """Creates all the tables of the models registered so far,
+        each one in the database of its bind.
 
         Only tables that do not already exist are created. Existing tables are
         not modified.
         """
-        kwargs.setdefault("bind", self.engine)
-        self.registry.metadata.create_all(**kwargs)
+        for bind, kwargs in self._iter_binds(kwargs):
+            self.registry.metadata.create_all(bind=bind, **kwargs)
 
     def drop_all(self, **kwargs) -> None:
         """Drop all the database tables.
@@ -105,12 +234,277 @@ class SQLAlchemy:
         Note that this is a destructive operation; data stored in the
         database will be deleted when this method is called.
         """
-        kwargs.setdefault("bind", self.engine)
-        self.registry.metadata.drop_all(**kwargs)
+        for bind, kwargs in self._iter_binds(kwargs):
+            self.registry.metadata.drop_all(bind=bind, **kwargs)
+
+    def get_bind_key(self, table: sa.Table) -> "str | None":
+        """Return the name of the bind of the table, or `None` if it uses
+        the default engine.
+        """
+        for mapper in self.registry.mappers:
+            if table in mapper.tables:
+                return getattr(mapper.class_, "__bind_key__", None)
+        return table.info.get("bind_key")
+
+    @property
+    def current_tenant(self) -> "str | None":
+        """The schema selected with `db.tenant()` in the current context."""
+        return self._current_tenant.get()
+
+    def tenant_engine(self, schema: str) -> sa.Engine:
+        """Return a proxy of the engine that renders the tables without an
+        explicit schema as part of the tenant `schema`.
+
+        These proxies are cached, and they share the connection pool and the
+        compiled statements cache of the engine (the schema is applied after
+        the compilation), so using thousands of tenants is cheap.
+        """
+        engine = self._tenant_engines.get(schema)
+        if engine is None:
+            engine = self.engine.execution_options(
+                schema_translate_map={None: schema}
+            )
+            self._tenant_engines[schema] = engine
+        return engine
+
+    @contextmanager
+    def tenant(self, schema: str) -> t.Iterator[t.Any]:
+        """Select a tenant schema until the end of the block.
+
+        The scoped session `db.s` is replaced by a new session for that tenant,
+        removed at the end. The tenant is stored in a context variable, so
+        concurrent threads or asyncio tasks can use different tenants.
+
+        Tables with an explicit schema (e.g.: "public") are shared by all tenants.
+
+        **Example**:
+
+        ```python
+        with db.tenant("customer_123"):
+            users = db.s.all(User)
+        ```
+
+        Args:
+            schema: Name of the schema of the tenant.
+
+        """
+        token = self._current_tenant.set(schema)
+        try:
+            with self.s.scope(bind=self.tenant_engine(schema)) as session:
+                yield session
+        finally:
+            self._current_tenant.reset(token)
+
+    def transaction(
+        self,
+        *,
+        retries: int = 3,
+        backoff: float = 0.05,
+        max_backoff: float = 2.0,
+        isolation_level: "str | None" = None,
+    ) -> Transaction:
+        """Run a block of code in a new session, commit it at the end, and
+        retry it, with a jittered exponential backoff, if it fails because
+        of a serialization failure or a deadlock.
+
+        The scoped session `db.s` points to the new session during each attempt.
+
+        **Examples**:
+
+        ```python
+        @db.transaction(retries=5, isolation_level="SERIALIZABLE")
+        def transfer(from_id, to_id, amount):
+            ...
+
+        for attempt in db.transaction():
+            with attempt:
+                ...
+        ```
+
+        Args:
+            retries: Maximum number of times to retry.
+            backoff: Base delay, in seconds, before retrying.
+            max_backoff: Maximum delay, in seconds, between attempts.
+            isolation_level: Optional isolation level for the transaction.
+
+        """
+        return Transaction(
+            self,
+            retries=retries,
+            backoff=backoff,
+            max_backoff=max_backoff,
+            isolation_level=isolation_level,
+        )
 
     def test_transaction(self, savepoint: bool = False) -> "TestTransaction":
         return TestTransaction(self, savepoint=savepoint)
 
+    def after_fork(self) -> None:
+        """Forget the pooled connections and sessions inherited from
+        the parent process.
+
+        This is called automatically in the child process after an `os.fork()`,
+        but some servers (e.g.: uWSGI) fork without going through Python,
+        so you might need to call it yourself in a post-fork hook.
+
+        The inherited connections are not closed, because they are still
+        in use by the parent process.
+        """
+        for engine in self._iter_engines():
+            engine.dispose(close=False)
+        if self.shard_executor is not None:
+            # The threads of the pool don't exist in the child process
+            inherited = self.shard_executor
+            self.shard_executor = self._make_shard_executor()
+            # Unless the session uses an executor given in `session_options`
+            if self.Session.kw.get("shard_executor") is inherited:
+                self.Session.kw["shard_executor"] = self.shard_executor
+        self.s.registry.clear()
+        for monitor in self.pool_monitors.values():
+            monitor.after_fork()
+        if self.warmup_after_fork:
+            self.warmup()
+
+    def pool_stats(self, bind_key: "str | None" = None) -> t.Dict[str, t.Any]:
+        """Return the usage statistics of the connection pool: connections
+        checked out and idle, overflow, checkout wait times, invalidations,
+        age of the connections, etc.
+
+        To also log them periodically, use
+        `db.pool_monitor.start_logging(interval=60)`.
+
+        Args:
+            bind_key: Name of the bind, or of the shard. The default engine
+                if `None`.
+
+        """
+        return self.pool_monitors[bind_key].snapshot()
+
+    def warmup(self, *statements: t.Any) -> t.Dict[str, float]:
+        """Pay up front the costs that otherwise land on the first requests
+        of a new process: configure the mappers, open the connections of the
+        pool, and compile the most common statements into the compiled cache
+        of the engine.
+
+        The statements compiled are the ones used by `db.s.all(Model)` and
+        `db.s.first(Model)` for every model, plus those in
+        `db.warmup_statements` and the ones passed as arguments.
+        Statements with filters are cached by "shape", so the values used
+        for the filters don't matter.
+
+        **Example**:
+
+        ```python
+        db.warmup_statements.append(select(User).filter_by(email=""))
+        timings = db.warmup()
+        # {"configure": 0.021, "pool": 0.034, "compile": 0.008}
+        ```
+
+        Args:
+            *statements: Extra statements to compile.
+
+        Returns:
+            The time, in seconds, spent in each phase.
+
+        """
+        timings = {}
+
+        start = perf_counter()
+        self.registry.configure()
+        timings["configure"] = perf_counter() - start
+
+        # The dialect is initialized on the first connection, so this must
+        # happen before compiling anything.
+        start = perf_counter()
+        for engine in self._iter_engines():
+            size = getattr(engine.pool, "size", None)
+            connections = [
+                engine.connect() for _ in range(size() if callable(size) else 1)
+            ]
+            for connection in connections:
+                connection.close()
+        timings["pool"] = perf_counter() - start
+
+        start = perf_counter()
+        for stmt in self._get_warmup_statements(statements):
+            self._compile(stmt)
+        timings["compile"] = perf_counter() - start
+
+        return timings
+
+    def _get_warmup_statements(self, extra: t.Iterable[t.Any]) -> t.List[t.Any]:
+        statements = []
+        for mapper in self.registry.mappers:
+            # Same shapes as `Session.all()` and `Session.first()`
+            statements.append(sa.select(mapper.class_).filter_by())
+            statements.append(sa.select(mapper.class_).filter_by().limit(1))
+        statements.extend(self.warmup_statements)
+        statements.extend(extra)
+        return statements
+
+    def _compile(self, stmt: t.Any) -> None:
+        """Compile the statement into the compiled cache of its engine,
+        exactly as `Connection.execute()` would do it with no parameters.
+        """
+        bind_key = None
+        if getattr(stmt, "is_select", False) and stmt.column_descriptions:
+            entity = stmt.column_descriptions[0].get("entity")
+            bind_key = getattr(entity, "__bind_key__", None)
+        engines = [self.engines[bind_key]]
+        if bind_key is None and self.shards:
+            engines = list(self.shards.values())
+        for engine in engines:
+            dialect = engine.dialect
+            stmt._compile_w_cache(
+                dialect=dialect,
+                compiled_cache=engine._compiled_cache,
+                column_keys=[],
+                for_executemany=False,
+                schema_translate_map=None,
+                linting=dialect.compiler_linting,
+            )
+
+    def _iter_engines(self) -> t.Iterator[sa.Engine]:
+        """Every engine, of the binds and of the shards, once."""
+        seen = set()
+        for engine in (*self.engines.values(), *self.shards.values()):
+            if id(engine) not in seen:
+                seen.add(id(engine))
+                yield engine
+
+    def _iter_binds(
+        self, kwargs: t.Dict[str, t.Any]
+    ) -> t.Iterator[t.Tuple[t.Any, t.Dict[str, t.Any]]]:
+        if "bind" in kwargs:
+            yield kwargs.pop("bind"), kwargs
+            return
+        default_engines = list(self.shards.values()) or [self.engine]
+        all_tables = kwargs.pop("tables", None) or self.registry.metadata.sorted_tables
+        bind_keys = {table: self.get_bind_key(table) for table in all_tables}
+        for table, key in bind_keys.items():
+            if key not in self.engines:
+                raise ValueError(
+                    f"The table {table.name!r} uses the bind {key!r}, "
+                    "but there is no bind with that name"
+                )
+        if len(self.engines) == 1:
+            for engine in default_engines:
+                yield engine, {**kwargs, "tables": all_tables}
+            return
+
+        for key, engine in self.engines.items():
+            tables = [table for table, table_key in bind_keys.items() if table_key == key]
+            for engine in default_engines if key is None else [engine]:
+                yield engine, {**kwargs, "tables": tables}
+
+    def _all_shards(self, *args: t.Any, **kwargs: t.Any) -> t.List[str]:
+        return list(self.shards)
+
+    def _make_shard_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(
+            max_workers=len(self.shards), thread_name_prefix="sqla_wrapper-shard"
+        )
+
     def _make_url(
         self,
         dialect: str,
@@ -144,6 +538,15 @@ class SQLAlchemy:
         return f"<SQLAlchemy('{self.url}')>"
 
 
+def _get_after_fork(ref: "weakref.ref[SQLAlchemy]") -> t.Callable[[], None]:
+    def after_fork() -> None:
+        db = ref()
+        if db is not None:
+            db.after_fork()
+
+    return after_fork
+
+
 class TestTransaction:
     """Helper for building sessions that rollback everyting at the end.
 
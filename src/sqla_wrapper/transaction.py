@@ -0,0 +1,188 @@
+import functools
+import random
+import threading
+import time
+import typing as t
+
+from sqlalchemy.exc import DBAPIError
+
+
+if t.TYPE_CHECKING:
+    from .sqlalchemy_wrapper import SQLAlchemy
+
+
+__all__ = ("Transaction", "is_retryable")
+
+# SQLSTATE codes of serialization failures and deadlocks
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+# MySQL error codes for deadlocks and lock wait timeouts
+RETRYABLE_MYSQL_ERRORS = {1213, 1205}
+RETRYABLE_SQLITE_MESSAGES = ("database is locked", "database table is locked")
+
+_stats_lock = threading.Lock()
+
+
+def is_retryable(error: BaseException, dialect_name: str = "") -> bool:
+    """Returns `True` if the error is a serialization failure or a
+    deadlock, so the transaction can be safely retried.
+    """
+    if not isinstance(error, DBAPIError):
+        return False
+    orig = error.orig
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    if dialect_name.startswith(("mysql", "mariadb")):
+        args = getattr(orig, "args", ())
+        return bool(args) and args[0] in RETRYABLE_MYSQL_ERRORS
+    if dialect_name == "sqlite":
+        message = str(orig)
+        return any(msg in message for msg in RETRYABLE_SQLITE_MESSAGES)
+    return False
+
+
+class Transaction:
+    """Run a block of code in a transaction, retrying it if it fails because
+    of a serialization failure or a deadlock.
+
+    The scoped session `db.s` is replaced by a new session for the duration
+    of each attempt, and it is committed at the end if there were no errors.
+
+    Use `db.transaction()` to create one. It can be used as a decorator:
+
+    ```python
+    @db.transaction(retries=5, isolation_level="SERIALIZABLE")
+    def transfer(from_id, to_id, amount):
+        ...
+    ```
+
+    or, because a `with` block can't be run again, as a loop of attempts:
+
+    ```python
+    for attempt in db.transaction(retries=5):
+        with attempt:
+            ...
+    ```
+
+    Used directly as a context manager, it runs the block just once.
+
+    The number of retries is counted in `db.transaction_stats`.
+
+    Args:
+        db: A `sqla_wrapper.SQLAlchemy` instance.
+        retries: Maximum number of times to retry.
+        backoff: Base delay, in seconds, before retrying. It is doubled after
+            each attempt and a random jitter is applied, so the contending
+            transactions don't retry at the same time.
+        max_backoff: Maximum delay, in seconds, between attempts.
+        isolation_level: Optional isolation level for the transaction,
+            e.g.: "SERIALIZABLE" or "REPEATABLE READ".
+
+    """
+
+    def __init__(
+        self,
+        db: "SQLAlchemy",
+        *,
+        retries: int = 3,
+        backoff: float = 0.05,
+        max_backoff: float = 2.0,
+        isolation_level: "str | None" = None,
+    ) -> None:
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.isolation_level = isolation_level
+        self._attempt: "_Attempt | None" = None
+
+    def __iter__(self) -> t.Iterator["_Attempt"]:
+        self._count("transactions")
+        for number in range(self.retries + 1):
+            attempt = _Attempt(self, last=number == self.retries)
+            yield attempt
+            if attempt.succeeded:
+                return
+            self._count("retries")
+            time.sleep(self._get_delay(number))
+
+    def __call__(self, fn: t.Callable) -> t.Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            for attempt in self:
+                with attempt:
+                    result = fn(*args, **kwargs)
+                if attempt.succeeded:
+                    return result
+
+        return wrapper
+
+    def __enter__(self) -> t.Any:
+        self._count("transactions")
+        self._attempt = _Attempt(self, last=True)
+        return self._attempt.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        assert self._attempt is not None
+        attempt, self._attempt = self._attempt, None
+        return attempt.__exit__(exc_type, exc_val, exc_tb)
+
+    def _get_delay(self, number: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**number))
+
+    def _count(self, name: str) -> None:
+        stats = self.db.transaction_stats
+        with _stats_lock:
+            stats[name] = stats.get(name, 0) + 1
+
+
+class _Attempt:
+    def __init__(self, transaction: Transaction, *, last: bool) -> None:
+        self.transaction = transaction
+        self.last = last
+        self.succeeded = False
+
+    def __enter__(self) -> t.Any:
+        tx = self.transaction
+        self._scope = tx.db.s.scope()
+        session = self._session = self._scope.__enter__()
+        if tx.isolation_level:
+            session.connection(
+                execution_options={"isolation_level": tx.isolation_level}
+            )
+        return session
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        tx = self.transaction
+        commit_error = None
+        try:
+            if exc_val is None:
+                try:
+                    tx.db.s.commit()
+                    self.succeeded = True
+                    return False
+                except Exception as error:
+                    # Serialization failures are often reported on commit
+                    commit_error = exc_val = error
+
+            retry = is_retryable(exc_val, _get_dialect_name(self._session, tx.db))
+            if retry and not self.last:
+                return True
+            if retry:
+                tx._count("gave_up")
+            if commit_error is not None:
+                raise commit_error
+            return False
+        finally:
+            self._scope.__exit__(None, None, None)
+
+
+def _get_dialect_name(session: t.Any, db: "SQLAlchemy") -> str:
+    """The name of the dialect of the session, that might not be the one
+    of the default engine.
+    """
+    try:
+        return session.get_bind().dialect.name
+    except Exception:
+        # e.g.: a sharded session can't choose a shard without a model
+        return db.engine.dialect.name
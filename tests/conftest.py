@@ -73,3 +73,18 @@ def dbs(db, dbsetup):
     tt = db.test_transaction(savepoint=True)
     yield db.s
     tt.close()
+
+
+@pytest.fixture()
+def tenantsdb(dst) -> SQLAlchemy:
+    """A SQLite database with two "schemas" (attached databases) named
+    "tenant1" and "tenant2".
+    """
+    db = SQLAlchemy(f"sqlite:///{dst}/main.db")
+
+    @sa.event.listens_for(db.engine, "connect")
+    def attach(dbapi_connection, connection_record):
+        for name in ("tenant1", "tenant2"):
+            dbapi_connection.execute(f"ATTACH DATABASE '{dst}/{name}.db' AS {name}")
+
+    return db
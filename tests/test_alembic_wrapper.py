@@ -1,7 +1,9 @@
+from pathlib import Path
+
 import pytest
 import sqlalchemy as sa
 from sqlalchemy.orm import Mapped, mapped_column
-from sqla_wrapper import Alembic
+from sqla_wrapper import Alembic, SQLAlchemy
 
 
 def _create_test_model1(memdb):
@@ -347,3 +349,365 @@ def test_get_flask_cli(memdb, dst, capsys):
     assert "  revision  " in stdout
     assert "  stamp  " in stdout
     assert "  upgrade  " in stdout
+
+
+def test_upgrade_tenants(tenantsdb, dst):
+    _create_test_model1(tenantsdb)
+    alembic = Alembic(tenantsdb, path=dst / "migrations")
+    rev1 = alembic.revision("test1")
+    alembic.upgrade_tenants(["tenant1", "tenant2"], create_schema=False)
+
+    assert alembic.for_tenant("tenant1").get_current() == rev1
+    assert alembic.for_tenant("tenant2").get_current() == rev1
+    assert alembic.get_current() is None
+
+    inspector = sa.inspect(tenantsdb.engine)
+    assert "test_model_1" not in inspector.get_table_names()
+    for schema in ("tenant1", "tenant2"):
+        tables = inspector.get_table_names(schema=schema)
+        assert tables == ["alembic_version", "test_model_1"]
+
+
+def test_revision_cache(memdb, dst, monkeypatch):
+    _create_test_model1(memdb)
+    alembic = Alembic(memdb, path=dst, revision_cache=True)
+    rev1 = alembic.revision("test1")
+    _create_test_model2(memdb)
+    alembic.upgrade()
+    rev2 = alembic.revision("test2")
+
+    assert alembic.get_head().revision == rev2.revision
+    assert (dst / "__pycache__" / "sqla_wrapper_revisions.json").is_file()
+
+    # A new instance reads the revisions without importing them
+    def fail(*args, **kwargs):
+        raise AssertionError("imported a revision file")
+
+    monkeypatch.setattr("alembic.util.load_python_file", fail)
+    alembic = Alembic(memdb, path=dst, revision_cache=True)
+    history = alembic.get_history()
+    assert [rev.revision for rev in history] == [rev1.revision, rev2.revision]
+    assert history[1].down_revision == rev1.revision
+    assert history[1].doc == "test2"
+    assert alembic.get_current().revision == rev1.revision
+
+
+def test_revision_include_tables(memdb, dst):
+    _create_test_model1(memdb)
+    _create_test_model2(memdb)
+    alembic = Alembic(memdb, path=dst)
+    rev = alembic.revision("test", include_tables=["*_1"])
+    rev_src = Path(rev.path).read_text()
+    assert "test_model_1" in rev_src
+    assert "test_model_2" not in rev_src
+
+    alembic = Alembic(memdb, path=dst / "schemas")
+    rev = alembic.revision("test", include_schemas=["main"])
+    assert "test_model_2" in Path(rev.path).read_text()
+
+    alembic = Alembic(memdb, path=dst / "objects")
+    rev = alembic.revision(
+        "test",
+        include_object=lambda obj, name, *args: name != "test_model_1",
+    )
+    rev_src = Path(rev.path).read_text()
+    assert "test_model_1" not in rev_src
+    assert "test_model_2" in rev_src
+
+
+def test_reflection_cache(memdb, dst):
+    _create_test_model1(memdb)
+    _create_test_model2(memdb)
+    alembic = Alembic(memdb, path=dst, reflection_cache=True)
+    alembic.revision("test")
+    alembic.upgrade()
+    rev = alembic.revision("nothing")
+    assert "op.create_table" not in Path(rev.path).read_text()
+    assert (dst / "__pycache__" / "sqla_wrapper_reflection.json").is_file()
+
+    # Both tables are now known to be unchanged
+    alembic.upgrade()
+    rev = alembic.revision("nothing")
+    assert not alembic.reflection_cache.is_needed("test_model_1")
+    assert not alembic.reflection_cache.is_needed("test_model_2")
+    assert "op.create_table" not in Path(rev.path).read_text()
+
+    alembic.upgrade()
+    with memdb.engine.begin() as conn:
+        conn.execute(sa.text("ALTER TABLE test_model_1 ADD COLUMN extra INTEGER"))
+    rev = alembic.revision("changed")
+    assert alembic.reflection_cache.is_needed("test_model_1")
+    assert not alembic.reflection_cache.is_needed("test_model_2")
+    assert "op.drop_column('test_model_1', 'extra')" in Path(rev.path).read_text()
+
+
+def test_reflection_cache_with_filters(memdb, dst):
+    _create_test_model1(memdb)
+    _create_test_model2(memdb)
+    alembic = Alembic(memdb, path=dst, reflection_cache=True)
+    alembic.revision("test")
+    alembic.upgrade()
+    assert alembic.check() == []
+
+    with memdb.engine.begin() as conn:
+        conn.execute(sa.text("ALTER TABLE test_model_1 ADD COLUMN extra INTEGER"))
+    # The filtered out tables are not remembered as unchanged
+    assert alembic.check(include_tables=["test_model_2"]) == []
+    assert [change.name for change in alembic.check()] == ["extra"]
+
+
+def test_check(memdb, dst, capsys):
+    _create_test_model1(memdb)
+    alembic = Alembic(memdb, path=dst)
+    alembic.revision("test1")
+    alembic.upgrade()
+    assert alembic.check() == []
+
+    _create_test_model2(memdb)
+    with memdb.engine.begin() as conn:
+        conn.execute(sa.text("ALTER TABLE test_model_1 ADD COLUMN extra INTEGER"))
+    changes = alembic.check()
+    assert sorted((change.action, change.table, change.name) for change in changes) == [
+        ("add_table", "test_model_2", None),
+        ("remove_column", "test_model_1", "extra"),
+    ]
+    assert [change.action for change in alembic.check(include_tables=["*_2"])] == [
+        "add_table"
+    ]
+    assert list(dst.glob("*.py")) == [Path(alembic.get_head().path)]
+
+    capsys.readouterr()
+    cli = alembic.get_click_cli()
+    exit_code = cli(args=["check"], prog_name="cli", standalone_mode=False)
+    assert exit_code == 1
+    stdout, _ = capsys.readouterr()
+    assert "remove_column test_model_1.extra" in stdout
+    assert "2 difference(s) with the models." in stdout
+
+
+def test_is_up_to_date(memdb, dst, monkeypatch):
+    _create_test_model1(memdb)
+    alembic = Alembic(memdb, path=dst)
+    alembic.revision("test1")
+    assert not alembic.is_up_to_date()
+
+    alembic.upgrade()
+    assert alembic.is_up_to_date()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the migrations ran")
+
+    monkeypatch.setattr(alembic, "_run_online", fail)
+    alembic.upgrade()
+
+
+def test_migrations_lock(dst):
+    db = SQLAlchemy(f"sqlite:///{dst / 'test.db'}")
+    _create_test_model1(db)
+    alembic = Alembic(db, path=dst / "migrations", lock_timeout=0.3)
+    alembic.revision("test1")
+
+    other = Alembic(db, path=dst / "migrations")
+    with other.lock():
+        with pytest.raises(TimeoutError):
+            alembic.upgrade()
+
+    alembic.upgrade()
+    assert alembic.is_up_to_date()
+
+    # Writing a revision file doesn't need the lock
+    with other.lock():
+        alembic.revision("test2")
+
+
+def test_upgrade_squashed_under_lock(dst, monkeypatch):
+    db = SQLAlchemy(f"sqlite:///{dst / 'test.db'}")
+    _create_test_model1(db)
+    alembic = Alembic(db, path=dst / "migrations")
+    alembic.revision("test1")
+
+    calls = []
+    lock = Alembic.lock
+    upgrade_squashed = Alembic._upgrade_squashed
+
+    def mock_lock(self):
+        calls.append("lock")
+        return lock(self)
+
+    def mock_upgrade_squashed(self):
+        calls.append("upgrade_squashed")
+        return upgrade_squashed(self)
+
+    monkeypatch.setattr(Alembic, "lock", mock_lock)
+    monkeypatch.setattr(Alembic, "_upgrade_squashed", mock_upgrade_squashed)
+    alembic.upgrade()
+    assert calls == ["lock", "upgrade_squashed"]
+
+
+def test_squash(dst):
+    path = dst / "migrations"
+    db = SQLAlchemy(f"sqlite:///{dst / 'old.db'}")
+    alembic = Alembic(db, path=path)
+    _create_test_model1(db)
+    rev1 = alembic.revision("test1")
+    alembic.upgrade()
+    _create_test_model2(db)
+    rev2 = alembic.revision("test2")
+
+    class TestModel3(db.Model):
+        __tablename__ = "test_model_3"
+        id: Mapped[int] = mapped_column(primary_key=True)
+
+    alembic.upgrade()
+    rev3 = alembic.revision("test3")
+    alembic.downgrade("-1")
+    assert alembic.get_current().revision == rev1.revision
+
+    baseline = alembic.squash(rev2.revision)
+    assert baseline.revision == rev2.revision
+    assert baseline.down_revision is None
+    assert [rev.revision for rev in alembic.get_history()] == [
+        rev2.revision, rev3.revision
+    ]
+    assert "op.create_table('test_model_2'" in Path(baseline.path).read_text()
+    archived = sorted(p.name for p in (path / "squashed" / rev2.revision).iterdir())
+    assert archived == sorted([Path(rev1.path).name, Path(rev2.path).name])
+
+    # A new database only runs the baseline and the later revisions
+    new_db = SQLAlchemy(f"sqlite:///{dst / 'new.db'}")
+    new_alembic = Alembic(new_db, path=path)
+    new_alembic.upgrade()
+    tables = sa.inspect(new_db.engine).get_table_names()
+    assert {"test_model_1", "test_model_2", "test_model_3"} <= set(tables)
+    assert new_alembic.is_up_to_date()
+
+    # A database at a squashed revision can still be upgraded
+    alembic = Alembic(db, path=path)
+    alembic.upgrade()
+    assert alembic.get_current().revision == rev3.revision
+
+
+def test_create_all_snapshot(dst, monkeypatch):
+    path = dst / "migrations"
+    db = SQLAlchemy("sqlite://")
+    alembic = Alembic(db, path=path)
+    _create_test_model1(db)
+    alembic.revision("test1")
+    alembic.upgrade()
+    _create_test_model2(db)
+    alembic.revision("test2")
+    alembic.upgrade()
+    # A statement that changes the database without changing any table
+    head = alembic.revision("pragma", empty=True)
+    rev_path = Path(head.path)
+    rev_path.write_text(
+        rev_path.read_text().replace("pass", 'op.execute("PRAGMA user_version = 7")', 1)
+    )
+    db.engine.dispose()
+
+    def create(name):
+        new_db = SQLAlchemy(f"sqlite:///{dst / name}")
+        _create_test_model1(new_db)
+        _create_test_model2(new_db)
+        new_alembic = Alembic(new_db, path=path)
+        new_alembic.create_all(snapshot=True)
+        return new_db, new_alembic
+
+    db1, alembic1 = create("db1.db")
+    assert alembic1.get_current().revision == head.revision
+    snapshots = list((path / "__pycache__" / "sqla_wrapper_snapshots").iterdir())
+    assert len(snapshots) == 1
+
+    # The second database is created without running the migrations
+    def fail(*args, **kwargs):
+        raise AssertionError("the migrations ran")
+
+    monkeypatch.setattr(Alembic, "_run_online", fail)
+    db2, alembic2 = create("db2.db")
+    assert alembic2.is_up_to_date()
+    tables = set(sa.inspect(db2.engine).get_table_names())
+    assert {"test_model_1", "test_model_2", "alembic_version"} <= tables
+    with db2.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA user_version").scalar() == 7
+
+
+def test_create_all_snapshot_for_tenants(tenantsdb, dst, monkeypatch):
+    _create_test_model1(tenantsdb)
+    alembic = Alembic(tenantsdb, path=dst / "migrations")
+    rev1 = alembic.revision("test1")
+    alembic.for_tenant("tenant1").create_all(snapshot=True)
+
+    # The snapshot of the first tenant is used for the second one
+    def fail(*args, **kwargs):
+        raise AssertionError("the migrations ran")
+
+    monkeypatch.setattr(Alembic, "_run_online", fail)
+    alembic.for_tenant("tenant2").create_all(snapshot=True)
+
+    snapshots = dst / "migrations" / "__pycache__" / "sqla_wrapper_snapshots"
+    assert len(list(snapshots.iterdir())) == 1
+    assert alembic.for_tenant("tenant2").get_current() == rev1
+    inspector = sa.inspect(tenantsdb.engine)
+    assert "test_model_1" not in inspector.get_table_names()
+    for schema in ("tenant1", "tenant2"):
+        tables = inspector.get_table_names(schema=schema)
+        assert tables == ["alembic_version", "test_model_1"]
+
+
+def test_upgrade_report(memdb, dst, capsys):
+    _create_test_model1(memdb)
+    alembic = Alembic(memdb, path=dst)
+    rev1 = alembic.revision("test1")
+    alembic.upgrade()
+    _create_test_model2(memdb)
+    rev2 = alembic.revision("test2")
+    alembic.downgrade("-1")
+
+    steps = []
+    report = alembic.upgrade(progress=steps.append)
+    assert [step.revision for step in report.steps] == [rev1.revision, rev2.revision]
+    assert steps == report.steps
+    assert report.steps[1].doc == "test2"
+    assert report.steps[1].statements > 0
+    assert report.duration >= sum(step.duration for step in report.steps)
+
+    report = alembic.downgrade("-1")
+    assert [step.revision for step in report.steps] == [rev2.revision]
+    assert not report.steps[0].is_upgrade
+
+    capsys.readouterr()
+    cli = alembic.get_click_cli()
+    cli(args=["upgrade"], prog_name="cli", standalone_mode=False)
+    stdout, _ = capsys.readouterr()
+    assert f"Upgraded to {rev2.revision} test2 in " in stdout
+    assert "1 revision(s) in " in stdout
+
+
+def test_upgrade_many(memdb, dst, capsys):
+    _create_test_model1(memdb)
+    alembic = Alembic(memdb, path=dst / "migrations")
+    rev1 = alembic.revision("test1")
+
+    urls = [f"sqlite:///{dst / f'db{i}.db'}" for i in range(3)]
+    urls.append(f"sqlite:///{dst / 'missing' / 'db.db'}")
+    results = alembic.upgrade_many(urls, workers=2)
+    assert [result.ok for result in results] == [True, True, True, False]
+    assert results[3].database == urls[3]
+
+    currents = alembic.run_many(urls[:3], "get_current", workers=1)
+    assert [result.result for result in currents] == [rev1.revision] * 3
+
+    with pytest.raises(TypeError):
+        alembic.upgrade_many(urls[0])
+    with pytest.raises(ValueError):
+        alembic.run_many(urls, "check")
+
+    capsys.readouterr()
+    cli = alembic.get_click_cli()
+    exit_code = cli(
+        args=["upgrade-many", *urls[2:]], prog_name="cli", standalone_mode=False
+    )
+    assert exit_code == 1
+    stdout, _ = capsys.readouterr()
+    assert f"{urls[2]}: OK" in stdout
+    assert "1 upgraded, 1 failed." in stdout
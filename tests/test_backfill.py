@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column
+
+from sqla_wrapper import Alembic, SQLAlchemy, backfill
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _create_users(db):
+    class User(db.Model):
+        __tablename__ = "users"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+        slug: Mapped[str] = mapped_column(sa.String(50), nullable=True)
+
+    return User
+
+
+def _insert_users(db, User, count):
+    db.create_all()
+    with db.engine.begin() as connection:
+        connection.execute(
+            sa.insert(User), [{"name": f"User{i}"} for i in range(count)]
+        )
+
+
+def test_backfill(memdb):
+    User = _create_users(memdb)
+    _insert_users(memdb, User, 2500)
+    calls = []
+
+    total = backfill(
+        "users",
+        {"slug": sa.func.lower(sa.column("name"))},
+        chunk_size=1000,
+        bind=memdb.engine,
+        progress=lambda total, last_key: calls.append((total, last_key)),
+    )
+    assert total == 2500
+    assert calls == [(1000, 1000), (2000, 2000), (2500, None)]
+    assert memdb.s.scalar(sa.select(sa.func.count()).where(User.slug.is_(None))) == 0
+    assert memdb.s.first(User, id=7).slug == "user6"
+
+
+def test_backfill_resume(memdb):
+    User = _create_users(memdb)
+    _insert_users(memdb, User, 2500)
+
+    def interrupt(total, last_key):
+        raise Interrupted
+
+    with pytest.raises(Interrupted):
+        backfill(
+            User.__table__,
+            {"slug": "x"},
+            chunk_size=1000,
+            bind=memdb.engine,
+            progress=interrupt,
+        )
+
+    total = backfill(User.__table__, {"slug": "x"}, chunk_size=1000, bind=memdb.engine)
+    assert total == 1500
+    query = sa.select(sa.func.count()).where(User.slug == "x")
+    assert memdb.s.scalar(query) == 2500
+
+
+def test_backfill_in_migration(dst):
+    db = SQLAlchemy(f"sqlite:///{dst / 'test.db'}")
+    User = _create_users(db)
+    alembic = Alembic(db, path=dst / "migrations")
+    alembic.revision("users")
+    alembic.upgrade()
+    _insert_users(db, User, 30)
+
+    rev = alembic.revision("backfill", empty=True)
+    code = rev.module.__file__
+    with open(code) as f:
+        source = f.read()
+    source = source.replace(
+        "def upgrade() -> None:\n",
+        "def upgrade() -> None:\n"
+        "    from sqla_wrapper import backfill\n"
+        "    backfill('users', {'slug': 'done'}, chunk_size=7)\n",
+    )
+    with open(code, "w") as f:
+        f.write(source)
+
+    alembic = Alembic(db, path=dst / "migrations")
+    alembic.upgrade()
+    assert db.s.scalar(sa.select(sa.func.count()).where(User.slug == "done")) == 30
+
+    # The progress table of the backfill is not part of the models
+    assert "sqla_wrapper_backfills" in sa.inspect(db.engine).get_table_names()
+    rev = alembic.revision("nothing")
+    assert "op." not in Path(rev.path).read_text()
@@ -1,3 +1,10 @@
+from datetime import date
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+
 def test_fill(dbs, TestModelA):
     obj = dbs.create(TestModelA, title="Remember")
     obj.fill(title="lorem ipsum")
@@ -15,3 +22,114 @@ def test_repr(dbs, TestModelA):
     assert f"<TestModelA #{id(obj)}" in repr
     assert f"\n id = {obj.id}" in repr
     assert "\n title = 'Hello world'" in repr
+
+
+def test_fill_unknown_attribute(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    with pytest.raises(AttributeError):
+        Tag().fill(nmae="foo")
+    # Not a mapped attribute
+    with pytest.raises(AttributeError):
+        Tag().fill(metadata="foo")
+
+
+def test_fill_fillable(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        __fillable__ = ["label"]
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+        @property
+        def label(self):
+            return self.name.title()
+
+        @label.setter
+        def label(self, value):
+            self.name = value.lower()
+
+    assert Tag().fill(label="Foo").name == "foo"
+    with pytest.raises(AttributeError):
+        Tag().fill(to_dict="foo")
+
+
+def test_to_dict_and_from_dict(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    tag = Tag.from_dict({"id": 1, "name": "foo"})
+    assert tag.to_dict() == {"id": 1, "name": "foo"}
+    assert "\n name = 'foo'" in repr(tag)
+
+
+def test_model_info_sees_backrefs(memdb):
+    class Author(memdb.Model):
+        __tablename__ = "authors"
+        id: Mapped[int] = mapped_column(primary_key=True)
+
+    assert repr(Author(id=1))
+
+    class Book(memdb.Model):
+        __tablename__ = "books"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        author_id: Mapped[int] = mapped_column(sa.ForeignKey("authors.id"))
+        author = relationship(Author, backref="books")
+
+    book = Book()
+    Author().fill(books=[book])
+
+
+def test_to_dict_options(memdb):
+    class Author(memdb.Model):
+        __tablename__ = "authors"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+        born: Mapped[date] = mapped_column(sa.Date)
+
+    class Book(memdb.Model):
+        __tablename__ = "books"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        author_id: Mapped[int] = mapped_column(sa.ForeignKey("authors.id"))
+        author = relationship(Author, backref="books")
+
+    memdb.create_all()
+    author = memdb.s.create(Author, name="Ursula", born=date(1929, 10, 21))
+    memdb.s.create(Book, author=author)
+    memdb.s.commit()
+    memdb.s.expunge_all()
+
+    author = memdb.s.first(Author)
+    assert author.to_dict() == {"id": 1, "name": "Ursula", "born": "1929-10-21"}
+    assert author.to_dict(only=["name"]) == {"name": "Ursula"}
+    assert author.to_dict(exclude=["id", "born"]) == {"name": "Ursula"}
+
+    # The relationship is not loaded yet
+    data = author.to_dict(only=["books"], relationships=True, unloaded="?")
+    assert data == {"books": "?"}
+    assert "books" not in author.__dict__
+
+    author.books  # noqa
+    data = author.to_dict(only=["books"], relationships=True)
+    assert data == {"books": [{"id": 1, "author_id": 1}]}
+
+    assert Author.to_dicts([author], only=["id"]) == [{"id": 1}]
+    with pytest.raises(AttributeError):
+        author.to_dict(only=["nmae"])
+
+
+def test_to_dict_after_commit(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    memdb.create_all()
+    tag = memdb.s.create(Tag, name="foo")
+    memdb.s.commit()
+    assert tag.to_dict() == {"id": 1, "name": "foo"}
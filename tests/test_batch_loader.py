@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column
+
+from sqla_wrapper import SQLAlchemy
+
+
+@pytest.fixture()
+def blogdb():
+    db = SQLAlchemy("sqlite://")
+
+    class Author(db.Model):
+        __tablename__ = "authors"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    class Post(db.Model):
+        __tablename__ = "posts"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        author_id: Mapped[int] = mapped_column(sa.ForeignKey("authors.id"))
+
+    db.create_all()
+    for i in range(1, 4):
+        db.s.create(Author, id=i, name=f"author{i}")
+        db.s.create(Post, author_id=i)
+        db.s.create(Post, author_id=i)
+    db.s.commit()
+    db.s.close()
+
+    db.Author = Author
+    db.Post = Post
+    db.queries = []
+    sa.event.listen(
+        db.engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: db.queries.append(statement),
+    )
+    return db
+
+
+def test_load(blogdb):
+    Author = blogdb.Author
+    loads = blogdb.s.load_all(Author, [3, 1, 99, 1])
+    assert blogdb.queries == []
+
+    assert [load.result() and load.result().name for load in loads] == [
+        "author3", "author1", None, "author1"
+    ]
+    assert len(blogdb.queries) == 1
+
+    # Remembered for the rest of the session
+    assert blogdb.s.load(Author, 99).result() is None
+    assert blogdb.s.load(Author, 2).done is False
+    blogdb.s.dispatch_loads()
+    assert len(blogdb.queries) == 2
+
+    blogdb.s.close()
+    blogdb.s.load(Author, 99).result()
+    assert len(blogdb.queries) == 3
+
+
+def test_load_many(blogdb):
+    Post = blogdb.Post
+    loads = blogdb.s.load_all(Post, [1, 2, 5], column="author_id", many=True)
+    blogdb.s.dispatch_loads()
+    assert [len(load.result()) for load in loads] == [2, 2, 0]
+    assert len(blogdb.queries) == 1
+
+
+def test_load_async(blogdb):
+    Author, Post = blogdb.Author, blogdb.Post
+
+    async def get_name(author_id):
+        author = await blogdb.s.load(Author, author_id)
+        return author.name
+
+    async def count_posts(author_id):
+        posts = await blogdb.s.load(Post, author_id, column="author_id", many=True)
+        return len(posts)
+
+    async def main():
+        return await asyncio.gather(
+            get_name(1), get_name(2), count_posts(1), count_posts(3)
+        )
+
+    assert asyncio.run(main()) == ["author1", "author2", 2, 2]
+    assert len(blogdb.queries) == 2
+
+
+def test_load_cleared_on_rollback(blogdb):
+    Author = blogdb.Author
+    blogdb.s.add(Author(id=10, name="draft"))
+    blogdb.s.flush()
+    assert blogdb.s.load(Author, "draft", column="name").result().id == 10
+
+    pending = blogdb.s.load(Author, 1, column="name")
+    blogdb.s.rollback()
+    with pytest.raises(sa.exc.InvalidRequestError):
+        pending.result()
+    assert blogdb.s.load(Author, "draft", column="name").result() is None
+
+
+def test_load_cleared_on_close(blogdb):
+    pending = blogdb.s.load(blogdb.Author, 1)
+    blogdb.s.close()
+    with pytest.raises(sa.exc.InvalidRequestError):
+        pending.result()
+    assert blogdb.queries == []
+
+
+def test_load_async_with_error(blogdb):
+    Author = blogdb.Author
+
+    async def main():
+        ok = blogdb.s.load(Author, 1)
+        bad = blogdb.s.load(Author, "x", column="nope")
+        with pytest.raises(AttributeError):
+            await bad
+        author = await asyncio.wait_for(ok, timeout=1)
+        return author.name
+
+    assert asyncio.run(main()) == "author1"
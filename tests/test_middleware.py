@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column
+
+from sqla_wrapper import ASGIMiddleware, SQLAlchemy, WSGIMiddleware
+
+
+@pytest.fixture()
+def ctxdb(dst):
+    db = SQLAlchemy(f"sqlite:///{dst}/test.db", session_scope="context")
+
+    class Note(db.Model):
+        __tablename__ = "notes"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        text: Mapped[str] = mapped_column(sa.String(50))
+
+    db.create_all()
+    db.Note = Note
+    return db
+
+
+def _count(db):
+    with db.Session() as dbs:
+        return dbs.execute(sa.select(sa.func.count()).select_from(db.Note)).scalar()
+
+
+def _wsgi_app(db, status):
+    def app(environ, start_response):
+        db.s.create(db.Note, text="hello")
+        start_response(status, [("Content-Type", "text/plain")])
+        return [b"ok"]
+
+    return app
+
+
+def _call_wsgi(app):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    result = app({}, start_response)
+    try:
+        response["body"] = b"".join(result)
+    finally:
+        result.close()
+    return response
+
+
+def test_wsgi_commit(ctxdb):
+    stats = []
+    app = WSGIMiddleware(_wsgi_app(ctxdb, "200 OK"), ctxdb, callback=stats.append)
+    response = _call_wsgi(app)
+
+    assert response["body"] == b"ok"
+    assert response["headers"]["Server-Timing"].startswith("db;dur=")
+    assert _count(ctxdb) == 1
+    assert stats[0].queries >= 1
+    assert stats[0].db_time > 0
+    assert not ctxdb.s.registry.has()
+
+
+def test_wsgi_rollback_on_error_status(ctxdb):
+    app = WSGIMiddleware(_wsgi_app(ctxdb, "400 Bad Request"), ctxdb)
+    _call_wsgi(app)
+    assert _count(ctxdb) == 0
+
+
+def test_wsgi_rollback_on_exception(ctxdb):
+    def app(environ, start_response):
+        ctxdb.s.create(ctxdb.Note, text="hello")
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        _call_wsgi(WSGIMiddleware(app, ctxdb))
+    assert _count(ctxdb) == 0
+    assert not ctxdb.s.registry.has()
+
+
+def test_wsgi_generator_app(ctxdb):
+    def app(environ, start_response):
+        ctxdb.s.create(ctxdb.Note, text="hello")
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        yield b"o"
+        yield b"k"
+
+    response = _call_wsgi(WSGIMiddleware(app, ctxdb))
+    assert response["status"] == "200 OK"
+    assert response["body"] == b"ok"
+    assert "Server-Timing" in response["headers"]
+    assert _count(ctxdb) == 1
+    assert not ctxdb.s.registry.has()
+
+    def failing_app(environ, start_response):
+        ctxdb.s.create(ctxdb.Note, text="hello")
+        start_response("200 OK", [])
+        raise RuntimeError
+        yield b""
+
+    with pytest.raises(RuntimeError):
+        _call_wsgi(WSGIMiddleware(failing_app, ctxdb))
+    assert _count(ctxdb) == 1
+    assert not ctxdb.s.registry.has()
+
+
+def test_wsgi_late_start_response(ctxdb):
+    class Body:
+        def __init__(self, start_response, status):
+            self.start_response = start_response
+            self.status = status
+
+        def __iter__(self):
+            yield b""
+            ctxdb.s.create(ctxdb.Note, text="hello")
+            self.start_response(self.status, [])
+            yield b"ok"
+
+    def app(status):
+        return lambda environ, start_response: Body(start_response, status)
+
+    response = _call_wsgi(WSGIMiddleware(app("404 Not Found"), ctxdb))
+    assert response["status"] == "404 Not Found"
+    assert _count(ctxdb) == 0
+
+    response = _call_wsgi(WSGIMiddleware(app("201 Created"), ctxdb))
+    assert response["body"] == b"ok"
+    assert _count(ctxdb) == 1
+
+
+def _call_asgi(app):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app({"type": "http"}, receive, send))
+    return messages
+
+
+def test_asgi_commit(ctxdb):
+    async def app(scope, receive, send):
+        ctxdb.s.create(ctxdb.Note, text="hello")
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    stats = []
+    messages = _call_asgi(ASGIMiddleware(app, ctxdb, callback=stats.append))
+    assert messages[0]["headers"][0][0] == b"server-timing"
+    assert _count(ctxdb) == 1
+    assert stats[0].queries >= 1
+
+
+def test_asgi_rollback_on_exception(ctxdb):
+    async def app(scope, receive, send):
+        ctxdb.s.create(ctxdb.Note, text="hello")
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        _call_asgi(ASGIMiddleware(app, ctxdb))
+    assert _count(ctxdb) == 0
+
+
+def test_asgi_requires_context_scope(dst):
+    db = SQLAlchemy(f"sqlite:///{dst}/test.db")
+
+    async def app(scope, receive, send):
+        pass
+
+    with pytest.raises(ValueError):
+        ASGIMiddleware(app, db)
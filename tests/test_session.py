@@ -1,3 +1,14 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Mapped, mapped_column
+
+from sqla_wrapper import SQLAlchemy
+
+
 def test_first(dbs, TestModelA):
     dbs.add(TestModelA(title="Lorem"))
     dbs.add(TestModelA(title="Ipsum"))
@@ -57,3 +68,170 @@ def test_first_or_create_using_create(dbs, TestModelA):
 
     obj = dbs.first_or_create(TestModelA, title="Lorem Ipsum")
     assert obj and obj.id == 1
+
+
+def test_scope(memdb):
+    outer = memdb.s()
+    with memdb.s.scope() as session:
+        assert memdb.s() is session
+        assert session is not outer
+    assert memdb.s() is outer
+    assert session.bind is memdb.engine
+
+
+def test_scope_removes_session(memdb):
+    with memdb.s.scope() as session:
+        pass
+    assert memdb.s() is not session
+
+
+def test_context_scope():
+    db = SQLAlchemy("sqlite://", session_scope="context")
+
+    async def get_session():
+        await asyncio.sleep(0)
+        return db.s()
+
+    async def main():
+        return await asyncio.gather(get_session(), get_session())
+
+    session1, session2 = asyncio.run(main())
+    assert session1 is not session2
+    assert db.s() is db.s()
+
+
+def test_context_scope_child_tasks():
+    db = SQLAlchemy("sqlite://", session_scope="context")
+
+    async def get_session():
+        await asyncio.sleep(0)
+        return db.s()
+
+    async def get_new_session():
+        with db.s.scope() as session:
+            await asyncio.sleep(0)
+            return session
+
+    async def main():
+        parent = db.s()
+        shared = await asyncio.gather(get_session(), get_session())
+        new = await asyncio.gather(get_new_session(), get_new_session())
+        return parent, shared, new
+
+    parent, shared, new = asyncio.run(main())
+    # Tasks created after the session exists share it
+    assert shared == [parent, parent]
+    assert parent not in new
+    assert new[0] is not new[1]
+
+
+def test_invalid_scope():
+    with pytest.raises(ValueError):
+        SQLAlchemy("sqlite://", session_scope="request")
+
+
+SLOW_QUERY = """
+WITH RECURSIVE cnt(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM cnt LIMIT 100000000)
+SELECT count(*) FROM cnt
+"""
+
+
+def test_statement_timeout(memdb):
+    with memdb.Session(statement_timeout=0.05) as dbs:
+        with pytest.raises(OperationalError, match="interrupted"):
+            dbs.execute(text(SLOW_QUERY))
+
+
+def test_timeout_scope(memdb):
+    fast = "SELECT 1"
+    with memdb.s.timeout(statement=0.05, lock=0.5):
+        with pytest.raises(OperationalError, match="interrupted"):
+            memdb.s.execute(text(SLOW_QUERY))
+        memdb.s.rollback()
+        assert memdb.s.execute(text("PRAGMA busy_timeout")).scalar() == 500
+
+    assert memdb.s().statement_timeout is None
+    assert memdb.s.execute(text(fast)).scalar() == 1
+    memdb.s.remove()
+
+    # The connection is back to normal after returning to the pool
+    with memdb.Session() as dbs:
+        assert dbs.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_batch(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    memdb.create_all()
+    round_trips = []
+
+    @sa.event.listens_for(memdb.engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT"):
+            round_trips.append(len(parameters) if executemany else 1)
+
+    with memdb.s.batch():
+        tags = [memdb.s.create(Tag, id=i, name=f"tag{i}") for i in range(1, 6)]
+        assert round_trips == []
+    assert round_trips == [5]
+    assert [tag.id for tag in tags] == [1, 2, 3, 4, 5]
+
+
+def test_batch_flush_on_read(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    memdb.create_all()
+    with memdb.s.batch():
+        memdb.s.create(Tag, name="a")
+        memdb.s.create(Tag, name="b")
+        assert len(memdb.s.all(Tag)) == 2
+
+
+def test_batch_create_or_first(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50), unique=True)
+
+    memdb.create_all()
+    memdb.s.create(Tag, name="a")
+    memdb.s.commit()
+
+    with memdb.s.batch():
+        memdb.s.create(Tag, name="b")
+        assert memdb.s.create_or_first(Tag, name="a").id == 1
+        assert memdb.s.create_or_first(Tag, name="c").id == 3
+    memdb.s.commit()
+    assert [tag.name for tag in memdb.s.all(Tag)] == ["a", "b", "c"]
+
+
+def test_as_record(memdb):
+    class Tag(memdb.Model):
+        __tablename__ = "tags"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    memdb.create_all()
+    memdb.s.create(Tag, name="a")
+    memdb.s.create(Tag, name="b")
+    memdb.s.commit()
+    memdb.s.expunge_all()
+
+    records = memdb.s.all(Tag, as_record=True)
+    assert [tuple(rec) for rec in records] == [(1, "a"), (2, "b")]
+    assert records[1].name == "b"
+    assert type(records[0]) is type(memdb.s.first(Tag, as_record=True, name="a"))
+    assert len(memdb.s.identity_map) == 0
+
+    names = memdb.s.all(Tag, as_record=["name"])
+    assert names[0]._fields == ("name",)
+    assert memdb.s.first(Tag, as_record=["name"], name="b").name == "b"
+    assert memdb.s.first(Tag, as_record=True, name="c") is None
+    with pytest.raises(AttributeError):
+        memdb.s.all(Tag, as_record=["nmae"])
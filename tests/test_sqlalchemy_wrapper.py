@@ -1,9 +1,13 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import sqlalchemy as sa
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Mapped, mapped_column
 
-from sqla_wrapper import SQLAlchemy
+from sqla_wrapper import SQLAlchemy, WSGIMiddleware, middleware
 
 
 def test_repr(memdb):
@@ -102,3 +106,270 @@ def test_single_table_inhertance(memdb):
         obj = dbs.first(Engineer)
         assert obj.engineer_name == "Bob"
         assert obj.type == "engineer"
+
+
+def test_warmup(memdb):
+    class Item(memdb.Model):
+        __tablename__ = "items"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    memdb.create_all()
+    memdb.warmup_statements.append(sa.select(Item).filter_by(name=""))
+    timings = memdb.warmup()
+    assert set(timings) == {"configure", "pool", "compile"}
+
+    hit = memdb.engine.dialect.CACHE_HIT
+    with memdb.Session() as dbs:
+        result = dbs.execute(sa.select(Item).filter_by())
+        assert result.raw.context.cache_hit == hit
+        result = dbs.execute(sa.select(Item).filter_by().limit(1))
+        assert result.raw.context.cache_hit == hit
+        result = dbs.execute(sa.select(Item).filter_by(name="foo"))
+        assert result.raw.context.cache_hit == hit
+
+
+def test_pool_stats(dst):
+    db = SQLAlchemy(f"sqlite:///{dst}/test.db", engine_options={"pool_size": 2})
+    conn1 = db.engine.connect()
+    conn2 = db.engine.connect()
+    stats = db.pool_stats()
+    assert stats["pool_size"] == 2
+    assert stats["checked_out"] == 2
+    assert stats["peak_checked_out"] == 2
+    assert stats["connects"] == 2
+
+    conn1.invalidate()
+    conn1.close()
+    conn2.close()
+    stats = db.pool_stats()
+    assert stats["checked_out"] == 0
+    assert stats["idle"] == 2
+    assert stats["checkouts"] == 2
+    assert stats["checkins"] == 2
+    assert stats["invalidations"] == 1
+    assert stats["connections"] == 1
+    assert stats["wait_max"] > 0
+
+
+def test_pool_stats_timeout(dst):
+    db = SQLAlchemy(
+        f"sqlite:///{dst}/test.db",
+        engine_options={"pool_size": 1, "max_overflow": 0, "pool_timeout": 0.01},
+    )
+    with db.engine.connect():
+        with pytest.raises(sa.exc.TimeoutError):
+            db.engine.connect()
+    assert db.pool_stats()["timeouts"] == 1
+
+    # Also through the copies of the engine and after a dispose
+    engine = db.engine.execution_options(schema_translate_map={None: "main"})
+    db.engine.dispose()
+    with db.engine.connect():
+        with pytest.raises(sa.exc.TimeoutError):
+            engine.connect()
+    assert db.pool_stats()["timeouts"] == 2
+
+
+def test_after_fork(memdb):
+    memdb.warmup_after_fork = True
+    pool = memdb.engine.pool
+    session = memdb.s()
+
+    monitor = memdb.pool_monitor
+    monitor.start_logging(interval=60)
+    stop_logging = monitor._stop_logging
+    # As if a thread of the parent was holding it
+    lock = monitor._lock
+    lock.acquire()
+
+    memdb.after_fork()
+    lock.release()
+    assert memdb.engine.pool is not pool
+    assert memdb.s() is not session
+    assert memdb.pool_stats()["connects"] == 1  # Warmed up again
+    assert monitor._stop_logging not in (None, stop_logging)
+    assert not stop_logging.is_set()
+    monitor.stop_logging()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork()")
+def test_fork_safe(memdb):
+    pool = memdb.engine.pool
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os._exit(0 if memdb.engine.pool is not pool else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert memdb.engine.pool is pool
+
+
+def test_binds(dst):
+    db = SQLAlchemy(
+        f"sqlite:///{dst}/main.db",
+        binds={"analytics": f"sqlite:///{dst}/analytics.db"},
+    )
+
+    class User(db.Model):
+        __tablename__ = "users"
+        id: Mapped[int] = mapped_column(primary_key=True)
+
+    class PageView(db.Model):
+        __tablename__ = "page_views"
+        __bind_key__ = "analytics"
+        id: Mapped[int] = mapped_column(primary_key=True)
+
+    db.create_all()
+    assert sa.inspect(db.engine).get_table_names() == ["users"]
+    assert sa.inspect(db.engines["analytics"]).get_table_names() == ["page_views"]
+    assert db.get_bind_key(PageView.__table__) == "analytics"
+
+    with db.Session() as dbs:
+        dbs.create(User)
+        dbs.create(PageView)
+        dbs.commit()
+        assert len(dbs.all(User)) == 1
+        assert len(dbs.all(PageView)) == 1
+        assert dbs.get_bind(PageView) is db.engines["analytics"]
+        assert dbs.get_bind(User) is db.engine
+
+    db.warmup()
+    assert db.pool_stats("analytics")["connects"] >= 1
+
+    db.drop_all()
+    assert sa.inspect(db.engine).get_table_names() == []
+    assert sa.inspect(db.engines["analytics"]).get_table_names() == []
+
+
+@pytest.mark.parametrize("binds", [None, {"analytics": "sqlite://"}])
+def test_unknown_bind_key(binds):
+    db = SQLAlchemy("sqlite://", binds=binds)
+
+    class PageView(db.Model):
+        __tablename__ = "page_views"
+        __bind_key__ = "analitycs"
+        id: Mapped[int] = mapped_column(primary_key=True)
+
+    with pytest.raises(ValueError, match="analitycs"):
+        db.create_all()
+    with db.Session() as dbs:
+        with pytest.raises(ValueError, match="'PageView'"):
+            dbs.get_bind(PageView)
+
+
+def test_tenants(tenantsdb):
+    db = tenantsdb
+
+    class Doc(db.Model):
+        __tablename__ = "docs"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        title: Mapped[str] = mapped_column(sa.String(50))
+
+    for schema in ("tenant1", "tenant2"):
+        db.create_all(bind=db.tenant_engine(schema))
+
+    assert db.tenant_engine("tenant1") is db.tenant_engine("tenant1")
+    assert db.tenant_engine("tenant1").pool is db.engine.pool
+
+    with db.tenant("tenant1") as session:
+        assert db.current_tenant == "tenant1"
+        assert db.s() is session
+        db.s.create(Doc, title="one")
+        db.s.commit()
+
+    assert db.current_tenant is None
+    with db.tenant("tenant2"):
+        assert db.s.all(Doc) == []
+    with db.tenant("tenant1"):
+        assert db.s.first(Doc).title == "one"
+
+
+def test_shards(dst):
+    db = SQLAlchemy(
+        shards={
+            "even": f"sqlite:///{dst}/even.db",
+            "odd": f"sqlite:///{dst}/odd.db",
+        },
+        shard_chooser=lambda mapper, instance, clause=None: (
+            "even" if instance.id % 2 == 0 else "odd"
+        ),
+        engine_options={"connect_args": {"check_same_thread": False}},
+    )
+
+    class Event(db.Model):
+        __tablename__ = "events"
+        id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+        name: Mapped[str] = mapped_column(sa.String(50))
+
+    db.create_all()
+    assert db.url == f"sqlite:///{dst}/even.db"
+    for engine in db.shards.values():
+        assert sa.inspect(engine).get_table_names() == ["events"]
+
+    threads = set()
+
+    for engine in db.shards.values():
+        @sa.event.listens_for(engine, "before_cursor_execute")
+        def record_thread(*args):
+            threads.add(threading.current_thread().name)
+
+    with db.Session() as dbs:
+        for id in range(1, 5):
+            dbs.create(Event, id=id, name=f"event{id}")
+        dbs.commit()
+
+        threads.clear()
+        events = dbs.all(Event)
+        assert sorted(event.id for event in events) == [1, 2, 3, 4]
+        assert threads
+        assert all(name.startswith("sqla_wrapper-shard") for name in threads)
+
+        assert dbs.first(Event, name="event3").id == 3
+        assert dbs.get(Event, 2).name == "event2"
+
+        # The pending objects are flushed before the parallel queries
+        flushes = []
+        sa.event.listen(
+            dbs,
+            "before_flush",
+            lambda *args: flushes.append(threading.current_thread().name),
+        )
+        for id in range(5, 200):
+            dbs.add(Event(id=id, name=f"event{id}"))
+        assert len(dbs.all(Event)) == 199
+        assert flushes == [threading.current_thread().name]
+
+    with sa.create_engine(f"sqlite:///{dst}/odd.db").connect() as conn:
+        ids = conn.execute(sa.text("SELECT id FROM events")).scalars().all()
+        assert sorted(ids) == [1, 3]
+
+
+def test_shards_engines(dst):
+    executor = ThreadPoolExecutor(max_workers=1)
+    db = SQLAlchemy(
+        shards={"a": f"sqlite:///{dst}/a.db", "b": f"sqlite:///{dst}/b.db"},
+        shard_chooser=lambda mapper, instance, clause=None: "a",
+        session_options={"shard_executor": executor},
+    )
+    assert set(db.pool_monitors) == {None, "b"}
+
+    checkouts = db.pool_monitors["b"].checkouts
+    db.warmup()
+    assert db.pool_monitors["b"].checkouts > checkouts
+
+    WSGIMiddleware(lambda environ, start_response: [], db)
+    assert sa.event.contains(
+        db.shards["b"], "before_cursor_execute", middleware._before_cursor_execute
+    )
+
+    # The executor given in the session options is kept after a fork
+    db.after_fork()
+    assert db.Session.kw["shard_executor"] is executor
+    assert db.shard_executor is not executor
+    executor.shutdown()
+
+
+def test_shards_require_chooser():
+    with pytest.raises(ValueError):
+        SQLAlchemy(shards={"a": "sqlite://"})
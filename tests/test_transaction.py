@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Mapped, mapped_column
+
+from sqla_wrapper import SQLAlchemy, is_retryable
+
+
+@pytest.fixture()
+def filedb(dst):
+    db = SQLAlchemy(f"sqlite:///{dst}/test.db")
+
+    class Account(db.Model):
+        __tablename__ = "accounts"
+        id: Mapped[int] = mapped_column(primary_key=True)
+        name: Mapped[str] = mapped_column(sa.String(50), unique=True)
+
+    db.create_all()
+    db.Account = Account
+    return db
+
+
+def _locked():
+    return OperationalError("UPDATE", {}, sqlite3.OperationalError("database is locked"))
+
+
+def _names(db):
+    with db.Session() as dbs:
+        return dbs.execute(sa.select(db.Account.name)).scalars().all()
+
+
+def test_is_retryable():
+    assert is_retryable(_locked(), "sqlite")
+    assert not is_retryable(_locked(), "postgresql")
+    assert not is_retryable(ValueError(), "sqlite")
+
+    class PGError(Exception):
+        pgcode = "40001"
+
+    assert is_retryable(OperationalError("", {}, PGError()), "postgresql")
+
+
+def test_decorator_retries(filedb):
+    calls = []
+
+    @filedb.transaction(retries=2, backoff=0)
+    def create(name):
+        calls.append(name)
+        filedb.s.create(filedb.Account, name=name)
+        if len(calls) < 3:
+            raise _locked()
+        return "done"
+
+    assert create("alice") == "done"
+    assert len(calls) == 3
+    assert _names(filedb) == ["alice"]
+    assert filedb.transaction_stats == {"transactions": 1, "retries": 2}
+
+
+def test_decorator_gives_up(filedb):
+    @filedb.transaction(retries=1, backoff=0)
+    def create():
+        filedb.s.create(filedb.Account, name="bob")
+        raise _locked()
+
+    with pytest.raises(OperationalError):
+        create()
+    assert _names(filedb) == []
+    assert filedb.transaction_stats["gave_up"] == 1
+
+
+def test_not_retryable(filedb):
+    filedb.transaction()(lambda: filedb.s.create(filedb.Account, name="bob"))()
+
+    calls = []
+
+    @filedb.transaction(backoff=0)
+    def create():
+        calls.append(1)
+        filedb.s.create(filedb.Account, name="bob")
+
+    with pytest.raises(IntegrityError):
+        create()
+    assert len(calls) == 1
+
+
+def test_attempts_loop(filedb):
+    calls = 0
+    for attempt in filedb.transaction(backoff=0):
+        with attempt as session:
+            calls += 1
+            assert filedb.s() is session
+            filedb.s.create(filedb.Account, name=f"name{calls}")
+            if calls == 1:
+                raise _locked()
+
+    assert calls == 2
+    assert _names(filedb) == ["name2"]
+
+
+def test_context_manager(filedb):
+    with filedb.transaction(isolation_level="SERIALIZABLE"):
+        filedb.s.create(filedb.Account, name="alice")
+    assert _names(filedb) == ["alice"]
+
+
+def test_retryable_by_session_dialect(dst):
+    db = SQLAlchemy("postgresql://localhost/unused")
+    db.Session.configure(bind=sa.create_engine(f"sqlite:///{dst}/test.db"))
+    calls = []
+
+    @db.transaction(retries=1, backoff=0)
+    def fail():
+        calls.append(1)
+        raise _locked()
+
+    with pytest.raises(OperationalError):
+        fail()
+    assert len(calls) == 2